@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Respaldo y restauración de alarmas.db y de los audios de Orange Clock
+
+Con --url trabaja contra el servicio en marcha (/api/admin/backup y /api/admin/restore), que
+al restaurar reprograma las alarmas por sí mismo. Sin --url usa directamente la base del
+directorio indicado (el WorkingDirectory del servicio) y la carpeta de audios; el respaldo
+local puede hacerse con el servicio en marcha, pero tras una restauración local hay que
+reiniciar el servicio.
+
+Uso:
+    python3 backup-cli.py respaldar orangeclock.tar.gz --url http://localhost:5000
+    python3 backup-cli.py restaurar orangeclock.tar.gz --url http://localhost:5000
+    python3 backup-cli.py respaldar orangeclock.tar.gz --directorio /home/orangepi/clock_api
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.request
+
+RUTA_BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedule-controller.py')
+
+def cargar_backend(directorio):
+    os.chdir(directorio)
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    spec = importlib.util.spec_from_file_location('schedule_controller', RUTA_BACKEND)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+def pedir(url, token, metodo='GET', cuerpo=None):
+    cabeceras = {'X-OrangeClock-Token': token} if token else {}
+    if cuerpo is not None:
+        cabeceras['Content-Type'] = 'application/gzip'
+    return urllib.request.urlopen(urllib.request.Request(url, data=cuerpo, method=metodo, headers=cabeceras),
+                                  timeout=600)
+
+def main():
+    parser = argparse.ArgumentParser(description="Respaldo y restauración de Orange Clock")
+    parser.add_argument('accion', choices=['respaldar', 'restaurar'])
+    parser.add_argument('archivo', help="archivo .tar.gz de respaldo")
+    parser.add_argument('--url', help="URL del servicio en marcha, p. ej. http://localhost:5000")
+    parser.add_argument('--token', default=os.environ.get('ORANGECLOCK_TOKEN', ''))
+    parser.add_argument('--directorio', default=os.getcwd(), help="directorio de alarmas.db (sin --url)")
+    args = parser.parse_args()
+    archivo = os.path.abspath(args.archivo)
+
+    try:
+        if args.url and args.accion == 'respaldar':
+            with pedir(f"{args.url.rstrip('/')}/api/admin/backup", args.token) as r, open(archivo, 'wb') as f:
+                shutil.copyfileobj(r, f)
+            print(f"[RESPALDO] ✓ Respaldo guardado en {archivo}")
+        elif args.url:
+            with open(archivo, 'rb') as f:
+                cuerpo = f.read()
+            with pedir(f"{args.url.rstrip('/')}/api/admin/restore", args.token, 'POST', cuerpo) as r:
+                print(f"[RESPALDO] ✓ {json.loads(r.read())}")
+        else:
+            backend = cargar_backend(args.directorio)
+            if args.accion == 'respaldar':
+                backend.crear_respaldo(archivo)
+                print(f"[RESPALDO] ✓ Respaldo guardado en {archivo}")
+            else:
+                backend.inicializar_db()
+                backend.restaurar_respaldo(archivo)
+                backend.inicializar_db()
+                print("[RESPALDO] Reinicie el servicio para reprogramar las alarmas restauradas")
+    except urllib.error.HTTPError as e:
+        print(f"[RESPALDO] ✗ HTTP {e.code}: {e.read().decode(errors='replace')}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"[RESPALDO] ✗ {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Prueba local del modo multi-nodo de schedule-controller.py
+
+Levanta un controlador y varios agentes como procesos independientes en esta máquina
+(cada uno con su directorio, base de datos, carpeta de audios y puerto), crea, edita y
+elimina alarmas en el controlador y mide cuánto tardan todos los agentes en tener el
+mismo horario y los mismos audios (comparados por hash).
+
+Uso:
+    python3 cluster-harness.py --agentes 5 --alarmas 50
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+RUTA_BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedule-controller.py')
+
+def pedir(url, metodo='GET', datos=None):
+    cuerpo = json.dumps(datos).encode() if datos is not None else None
+    req = urllib.request.Request(url, data=cuerpo, method=metodo, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return json.loads(r.read())
+
+def esperar_arranque(url, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            return pedir(f"{url}/api/consultar_alarmas")
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"El nodo {url} no arrancó en {timeout} s")
+
+def horario(url):
+    alarmas = pedir(f"{url}/api/consultar_alarmas")["alarmas_programadas"]
+    return sorted((a["id"], a["hora"], a["audio"], a["repeticion"], a["fecha"]) for a in alarmas)
+
+def hashes(carpeta):
+    resultado = {}
+    for nombre in sorted(os.listdir(carpeta)):
+        with open(os.path.join(carpeta, nombre), 'rb') as f:
+            resultado[nombre] = hashlib.sha256(f.read()).hexdigest()
+    return resultado
+
+def esperar_convergencia(controlador, agentes, timeout):
+    """Segundos hasta que todos los agentes tienen el horario y los audios del controlador"""
+    inicio = time.monotonic()
+    esperado = horario(controlador['url'])
+    audios = hashes(controlador['audios'])
+    pendientes = list(agentes)
+    while pendientes:
+        if time.monotonic() - inicio > timeout:
+            raise RuntimeError(f"{len(pendientes)} agentes sin converger: {[a['url'] for a in pendientes]}")
+        pendientes = [a for a in pendientes if horario(a['url']) != esperado or hashes(a['audios']) != audios]
+        if pendientes:
+            time.sleep(0.1)
+    return time.monotonic() - inicio
+
+def lanzar(directorio, nombre, puerto, entorno):
+    carpeta = os.path.join(directorio, nombre)
+    audios = os.path.join(carpeta, 'audios')
+    os.makedirs(audios)
+    env = dict(os.environ, ORANGECLOCK_PUERTO=str(puerto), ORANGECLOCK_AUDIOS=audios,
+               SDL_AUDIODRIVER='dummy', **entorno)
+    env.pop('DISPLAY', None)
+    log = open(os.path.join(carpeta, 'salida.log'), 'w')
+    proceso = subprocess.Popen([sys.executable, RUTA_BACKEND], cwd=carpeta, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return {'nombre': nombre, 'url': f"http://127.0.0.1:{puerto}", 'audios': audios,
+            'proceso': proceso, 'log': log}
+
+def reiniciar(agente, controlador, borrar):
+    """Mata un agente y lo vuelve a levantar; con borrar=True pierde su base y sus audios"""
+    agente['proceso'].kill()
+    agente['proceso'].wait()
+    carpeta = os.path.dirname(agente['audios'])
+    if borrar:
+        os.remove(os.path.join(carpeta, 'alarmas.db'))
+        for nombre in os.listdir(agente['audios']):
+            os.remove(os.path.join(agente['audios'], nombre))
+    agente['log'].close()
+    env = {'ORANGECLOCK_MODO': 'agente', 'ORANGECLOCK_CONTROLADOR': controlador['url'],
+           'ORANGECLOCK_TOKEN': 'prueba', 'ORANGECLOCK_PUERTO': agente['url'].rsplit(':', 1)[1],
+           'ORANGECLOCK_AUDIOS': agente['audios'], 'SDL_AUDIODRIVER': 'dummy'}
+    agente['log'] = open(os.path.join(carpeta, 'salida.log'), 'a')
+    agente['proceso'] = subprocess.Popen([sys.executable, RUTA_BACKEND], cwd=carpeta, env=dict(os.environ, **env),
+                                         stdout=agente['log'], stderr=subprocess.STDOUT)
+    esperar_arranque(agente['url'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Controlador y agentes locales del modo multi-nodo")
+    parser.add_argument('--agentes', type=int, default=5)
+    parser.add_argument('--alarmas', type=int, default=50)
+    parser.add_argument('--puerto-base', type=int, default=5100)
+    parser.add_argument('--timeout', type=float, default=60, help="segundos máximos para converger")
+    args = parser.parse_args()
+
+    nodos = []
+    with tempfile.TemporaryDirectory() as directorio:
+        try:
+            urls_agentes = [f"http://127.0.0.1:{args.puerto_base + 1 + i}" for i in range(args.agentes)]
+            controlador = lanzar(directorio, 'controlador', args.puerto_base, {
+                'ORANGECLOCK_MODO': 'controlador',
+                'ORANGECLOCK_AGENTES': ','.join(urls_agentes),
+                'ORANGECLOCK_TOKEN': 'prueba'
+            })
+            nodos.append(controlador)
+            agentes = []
+            for i in range(args.agentes):
+                agente = lanzar(directorio, f"agente{i}", args.puerto_base + 1 + i, {
+                    'ORANGECLOCK_MODO': 'agente',
+                    'ORANGECLOCK_CONTROLADOR': controlador['url'],
+                    'ORANGECLOCK_TOKEN': 'prueba'
+                })
+                agentes.append(agente)
+                nodos.append(agente)
+            for nodo in nodos:
+                esperar_arranque(nodo['url'])
+
+            for i in range(3):
+                with open(os.path.join(controlador['audios'], f"timbre{i}.wav"), 'wb') as f:
+                    f.write(os.urandom(256 * 1024))
+            ids = []
+            for i in range(args.alarmas):
+                r = pedir(f"{controlador['url']}/api/crear_alarma", 'POST',
+                          {'hora': f"{i // 60:02d}:{i % 60:02d}", 'audio': f"timbre{i % 3}.wav"})
+                ids.append(r['id'])
+            print(f"[CLUSTER] {args.alarmas} alarmas y 3 audios en {args.agentes} agentes: "
+                  f"{esperar_convergencia(controlador, agentes, args.timeout):.2f} s")
+
+            pedir(f"{controlador['url']}/api/editar_alarma/{ids[0]}", 'PUT',
+                  {'hora': '23:59', 'audio': 'timbre1.wav', 'repeticion': 'mon-fri'})
+            pedir(f"{controlador['url']}/api/eliminar_alarma/{ids[1]}", 'DELETE')
+            print(f"[CLUSTER] Edición y eliminación (delta): "
+                  f"{esperar_convergencia(controlador, agentes, args.timeout):.2f} s")
+
+            # Un agente que se corta (kill, como un corte de luz) y reinicia con su base intacta
+            # recibe solo lo que le falta
+            agentes[0]['proceso'].kill()
+            agentes[0]['proceso'].wait()
+            pedir(f"{controlador['url']}/api/crear_alarma", 'POST',
+                  {'hora': '23:58', 'audio': 'timbre2.wav', 'repeticion': 'sat'})
+            reiniciar(agentes[0], controlador, borrar=False)
+            pedir(f"{controlador['url']}/api/nodos/sincronizar", 'POST')
+            print(f"[CLUSTER] Agente reiniciado: {esperar_convergencia(controlador, agentes, args.timeout):.2f} s")
+
+            # Una placa reinstalada (sin base ni audios) sin cambios nuevos en el controlador:
+            # con sincronización forzada, y sin ella por el sondeo periódico del controlador
+            reiniciar(agentes[0], controlador, borrar=True)
+            pedir(f"{controlador['url']}/api/nodos/sincronizar", 'POST')
+            print(f"[CLUSTER] Agente reinstalado (forzado): "
+                  f"{esperar_convergencia(controlador, agentes, args.timeout):.2f} s")
+            reiniciar(agentes[-1], controlador, borrar=True)
+            print(f"[CLUSTER] Agente reinstalado (sondeo): "
+                  f"{esperar_convergencia(controlador, agentes, args.timeout):.2f} s")
+
+            estado = pedir(f"{controlador['url']}/api/nodos")
+            errores = [a for a in estado['agentes'] if a['error']]
+            if errores:
+                print(f"[CLUSTER] ✗ Agentes con error: {errores}")
+                sys.exit(1)
+            print("[CLUSTER] ✓ Todos los agentes sincronizados")
+        except Exception as e:
+            print(f"[CLUSTER] ✗ {e}")
+            for nodo in nodos:
+                nodo['log'].flush()
+                with open(nodo['log'].name) as f:
+                    print(f"[CLUSTER] --- {nodo['nombre']} ---\n" + ''.join(f.readlines()[-15:]))
+            sys.exit(1)
+        finally:
+            # pygame (SDL) captura SIGTERM, así que los nodos se detienen con kill
+            for nodo in nodos:
+                nodo['proceso'].kill()
+            for nodo in nodos:
+                nodo['proceso'].wait()
+                nodo['log'].close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Precomprime el build del frontend para servirlo desde schedule-controller.py
+
+Junto a cada archivo de texto (js, css, html, json, svg, map...) escribe su versión .gz y, si
+el módulo brotli está instalado, .br, solo cuando resultan más chicas que el original. El
+backend (ORANGECLOCK_FRONTEND) elige la variante según el Accept-Encoding del navegador, así
+la compresión se paga una vez al instalar y nunca por petición.
+
+Uso:
+    python3 precompress-build.py /var/www/clock_frontend
+"""
+import argparse
+import gzip
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXTENSIONES = {'.html', '.js', '.css', '.json', '.map', '.svg', '.txt', '.ico', '.webmanifest'}
+TAMANO_MINIMO = 1024  # por debajo de esto la cabecera de compresión no compensa
+
+def comprimir(ruta, sufijo, funcion):
+    destino = ruta + sufijo
+    if os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(ruta):
+        return 0
+    with open(ruta, 'rb') as f:
+        original = f.read()
+    comprimido = funcion(original)
+    if len(comprimido) >= len(original):
+        if os.path.exists(destino):
+            os.remove(destino)
+        return 0
+    temporal = destino + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(comprimido)
+    os.replace(temporal, destino)
+    return len(original) - len(comprimido)
+
+def main():
+    parser = argparse.ArgumentParser(description="Precomprime (gzip/brotli) el build del frontend")
+    parser.add_argument('build', help="carpeta del build (la que contiene index.html)")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.build, 'index.html')):
+        print(f"[BUILD] ✗ No se encontró index.html en {args.build}")
+        sys.exit(1)
+    if brotli is None:
+        print("[BUILD] brotli no disponible: solo se generan archivos .gz")
+
+    archivos = 0
+    ahorro = 0
+    for carpeta, _, nombres in os.walk(args.build):
+        for nombre in nombres:
+            ruta = os.path.join(carpeta, nombre)
+            if os.path.splitext(nombre)[1].lower() not in EXTENSIONES or os.path.getsize(ruta) < TAMANO_MINIMO:
+                continue
+            archivos += 1
+            ahorro += comprimir(ruta, '.gz', lambda datos: gzip.compress(datos, compresslevel=9, mtime=0))
+            if brotli is not None:
+                ahorro += comprimir(ruta, '.br', lambda datos: brotli.compress(datos, quality=11))
+    print(f"[BUILD] ✓ {archivos} archivos precomprimidos ({ahorro // 1024} KB ahorrados en total)")
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,38 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
 import pygame
 import time
 import sqlite3
 import os
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 import platform
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 from waitress import serve
 import threading
 import logging
 import sys
+import subprocess
+import shutil
+import signal
+import uuid
+import functools
+import hashlib
+import bisect
+import wave
+import json
+import gzip
+import io
+import tarfile
+import tempfile
+import mimetypes
+import socket
+import urllib.request
+import urllib.error
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 # Configurar logging para systemd
 logging.basicConfig(
@@ -24,10 +45,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Variables globales
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # /static/ es del frontend (ORANGECLOCK_FRONTEND)
 CORS(app) # Habilitar CORS para todas las rutas
 #CORS(app, origins=["http://localhost:3000"])
-scheduler = BackgroundScheduler()
+HILOS_SCHEDULER = 10  # hilos del pool que ejecuta las alarmas (el valor por defecto de APScheduler)
+scheduler = BackgroundScheduler(executors={'default': {'type': 'threadpool', 'max_workers': HILOS_SCHEDULER}})
 
 # Inicializar pygame de forma segura
 try:
@@ -36,6 +58,18 @@ try:
 except Exception as e:
     print(f"[INIT] Advertencia: Error al inicializar pygame: {e}")
 
+def ruta_audios():
+    """Directorio de audios; ORANGECLOCK_AUDIOS permite usar otro (p. ej. en el arnés de simulación)"""
+    if os.environ.get('ORANGECLOCK_AUDIOS'):
+        return os.environ['ORANGECLOCK_AUDIOS']
+    if platform.system().lower() == "windows":
+        return "c:\\orangeClock\\audios"
+    return "/orangeClock/audios"
+
+def hora_actual():
+    """Hora actual usada por el scheduler y los cálculos de fechas; el arnés de simulación la sustituye"""
+    return datetime.now()
+
 # Iniciar base de datos
 # Agrega el campo fecha a la tabla si no existe
 
@@ -56,6 +90,36 @@ def inicializar_db():
     columnas = [col[1] for col in cursor.fetchall()]
     if 'fecha' not in columnas:
         cursor.execute("ALTER TABLE alarmas ADD COLUMN fecha TEXT DEFAULT NULL")
+    # 3. Duración máxima y fade-out de la reproducción (segundos)
+    if 'duracion_max' not in columnas:
+        cursor.execute("ALTER TABLE alarmas ADD COLUMN duracion_max INTEGER DEFAULT NULL")
+    if 'fade_out' not in columnas:
+        cursor.execute("ALTER TABLE alarmas ADD COLUMN fade_out INTEGER DEFAULT NULL")
+    # Ganancia (factor lineal) y fade-in (segundos), renderizados antes de sonar
+    if 'fade_in' not in columnas:
+        cursor.execute("ALTER TABLE alarmas ADD COLUMN fade_in INTEGER DEFAULT NULL")
+    if 'ganancia' not in columnas:
+        cursor.execute("ALTER TABLE alarmas ADD COLUMN ganancia REAL DEFAULT NULL")
+    # 4. Registro de cambios (controlador) y versión del horario recibido (agente)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cambios (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            alarma_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE TABLE IF NOT EXISTS sincronizacion (clave TEXT PRIMARY KEY, valor TEXT)")
+    # 5. Excepciones (feriados) globales o por alarma
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS excepciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alarma_id INTEGER DEFAULT NULL,
+            desde TEXT NOT NULL,
+            hasta TEXT NOT NULL,
+            motivo TEXT DEFAULT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_excepciones_alarma ON excepciones (alarma_id, desde)")
     conn.commit()
     conn.close()
 
@@ -64,15 +128,12 @@ def inicializar_sistema():
     print("[INIT] Iniciando sistema de alarmas...", flush=True)
     logger.info("[INIT] Iniciando sistema de alarmas...")
     
-    # 1. Inicializar base de datos
+    # 1. Inicializar base de datos y excepciones
     inicializar_db()
+    recargar_excepciones()
     
     # 2. Crear directorio de audios si no existe
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        base_audio = "c:\\orangeClock\\audios"
-    else:
-        base_audio = "/orangeClock/audios"
+    base_audio = ruta_audios()
     
     if not os.path.exists(base_audio):
         os.makedirs(base_audio, exist_ok=True)
@@ -82,6 +143,7 @@ def inicializar_sistema():
     if not scheduler.running:
         scheduler.start()
         print("[INIT] Scheduler iniciado")
+    iniciar_monitor()
     
     # 4. Cargar alarmas con un pequeño delay para asegurar que todo esté listo
     import threading
@@ -94,6 +156,10 @@ def inicializar_sistema():
     thread.daemon = True
     thread.start()
     
+    # 5. En modo controlador, difundir el horario a los agentes
+    if MODO_NODO == 'controlador':
+        iniciar_difusion()
+    
     print("[INIT] Sistema inicializado correctamente")
 
 # Cambia la ruta base de audios a la raíz orangeClock
@@ -186,15 +252,245 @@ def mostrar_mensaje_flotante(titulo, mensaje, tipo="info"):
     thread.daemon = True
     thread.start()
 
-def reproducir_audio(audio_path):
-    import subprocess
-    import shutil
-    
+# Sesiones de reproducción activas: permiten listar, detener y posponer alarmas sonando
+DURACION_MAX_DEFECTO = 300  # segundos máximos de reproducción si la alarma no define otro valor
+POSPONER_MINUTOS_DEFECTO = 5
+_sesiones = {}
+_sesiones_lock = threading.Lock()
+
+def _iniciar_sesion(audio_path, alarma_id, duracion_max, fade_out, fade_in=None, ganancia=None):
+    sesion = {
+        'id': uuid.uuid4().hex[:8],
+        'alarma_id': alarma_id,
+        'audio': audio_path,
+        'inicio': hora_actual(),
+        'duracion_max': duracion_max or DURACION_MAX_DEFECTO,
+        'fade_out': fade_out or 0,
+        'fade_in': fade_in,
+        'ganancia': ganancia,
+        'reproductor': None,
+        'proceso': None,
+        'detener': threading.Event(),
+        'motivo': None
+    }
+    with _sesiones_lock:
+        _sesiones[sesion['id']] = sesion
+    return sesion
+
+def _finalizar_sesion(sesion):
+    with _sesiones_lock:
+        _sesiones.pop(sesion['id'], None)
+
+def sesion_a_dict(sesion):
+    return {
+        'id': sesion['id'],
+        'alarma_id': sesion['alarma_id'],
+        'audio': sesion['audio'],
+        'inicio': sesion['inicio'].strftime("%Y-%m-%d %H:%M:%S"),
+        'duracion_max': sesion['duracion_max'],
+        'fade_out': sesion['fade_out'],
+        'reproductor': sesion['reproductor']
+    }
+
+def detener_sesion(sesion_id, motivo='detenida'):
+    """Marca la sesión para detenerse; el hilo que reproduce libera el dispositivo"""
+    with _sesiones_lock:
+        sesion = _sesiones.get(sesion_id)
+    if sesion is None:
+        return None
+    sesion['motivo'] = motivo
+    sesion['detener'].set()
+    return sesion
+
+def _esperar_reproduccion(sesion, sigue_sonando):
+    """Espera el fin del audio, una orden de detener o la duración máxima; devuelve el motivo"""
+    limite = time.monotonic() + sesion['duracion_max']
+    while sigue_sonando():
+        if sesion['detener'].wait(0.25):
+            return sesion['motivo'] or 'detenida'
+        if time.monotonic() >= limite:
+            return 'tiempo'
+    return 'fin'
+
+def _terminar_proceso(proceso):
+    """Termina el grupo de procesos del reproductor y fuerza su cierre si no responde"""
+    try:
+        os.killpg(proceso.pid, signal.SIGTERM)
+        proceso.wait(timeout=2)
+    except subprocess.TimeoutExpired:
+        os.killpg(proceso.pid, signal.SIGKILL)
+        proceso.wait()
+    except ProcessLookupError:
+        proceso.wait()
+
+def _reproducir_con_proceso(sesion, comando):
+    """Ejecuta un reproductor externo en su propio grupo de procesos.
+
+    Devuelve True si sonó hasta el final o fue detenido, False si el reproductor falló.
+    """
+    proceso = subprocess.Popen(comando, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    sesion['reproductor'] = comando[0]
+    sesion['proceso'] = proceso
+    try:
+        motivo = _esperar_reproduccion(sesion, lambda: proceso.poll() is None)
+    finally:
+        if proceso.poll() is None:
+            _terminar_proceso(proceso)
+        sesion['proceso'] = None
+    if motivo != 'fin':
+        print(f"[AUDIO] Reproducción {sesion['id']} finalizada ({motivo}) con {comando[0]}")
+        return True
+    return proceso.returncode == 0
+
+# Renderizado previo de ganancia y rampas (fade-in/fade-out) con NumPy.
+# Se calcula una sola vez, al programar la alarma, y se guarda como WAV en la carpeta de
+# renders con nombre derivado de (hash del audio, parámetros); al sonar solo se reproduce
+# el archivo ya calculado. Si NumPy no está disponible se reproduce el audio original.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    print("[RENDER] NumPy no disponible: la ganancia y las rampas no se aplicarán")
+
+BLOQUE_RENDER = 65536  # frames procesados por bloque para acotar la memoria usada
+_renderizador = ThreadPoolExecutor(max_workers=1)
+_renders_pendientes = set()
+_renders_lock = threading.Lock()
+
+def ruta_renders():
+    return os.path.join(os.path.dirname(ruta_audios().rstrip('/\\')), 'renders')
+
+def requiere_render(ganancia, fade_in, fade_out):
+    return bool(fade_in or fade_out or (ganancia and ganancia != 1))
+
+def ruta_render(ruta_audio, ganancia, fade_in, fade_out, duracion_max):
+    """Ruta del render en cache; solo consulta el hash ya calculado del audio"""
+    clave = (f"{hash_archivo(ruta_audio)}:{float(ganancia or 1):g}:{int(fade_in or 0)}:{int(fade_out or 0)}:"
+             f"{int(duracion_max or DURACION_MAX_DEFECTO)}")
+    return os.path.join(ruta_renders(), hashlib.sha256(clave.encode()).hexdigest()[:24] + '.wav')
+
+def _decodificar_wav(ruta_audio, temporal):
+    """Devuelve una ruta WAV PCM del audio (los mp3 se decodifican con mpg123)"""
+    if os.path.splitext(ruta_audio)[1].lower() == '.wav':
+        return ruta_audio
+    if not shutil.which("mpg123"):
+        raise RuntimeError("mpg123 no disponible para decodificar mp3")
+    subprocess.run(["mpg123", "-q", "-w", temporal, ruta_audio], check=True, timeout=300,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return temporal
+
+def renderizar_audio(ruta_audio, ganancia, fade_in, fade_out, duracion_max):
+    """Aplica ganancia y rampas lineales al PCM y guarda el resultado; devuelve la ruta del render"""
+    destino = ruta_render(ruta_audio, ganancia, fade_in, fade_out, duracion_max)
+    if os.path.exists(destino):
+        return destino
+    os.makedirs(ruta_renders(), exist_ok=True)
+    decodificado = destino + '.pcm.wav'
+    temporal = destino + '.tmp'
+    try:
+        with wave.open(_decodificar_wav(ruta_audio, decodificado), 'rb') as entrada:
+            if entrada.getsampwidth() != 2:
+                raise RuntimeError(f"Solo se renderiza PCM de 16 bits (archivo de {entrada.getsampwidth() * 8} bits)")
+            canales = entrada.getnchannels()
+            frecuencia = entrada.getframerate()
+            total = min(entrada.getnframes(), int((duracion_max or DURACION_MAX_DEFECTO) * frecuencia))
+            frames_in = max(int((fade_in or 0) * frecuencia), 1)
+            frames_out = max(int((fade_out or 0) * frecuencia), 1)
+            with wave.open(temporal, 'wb') as salida:
+                salida.setnchannels(canales)
+                salida.setsampwidth(2)
+                salida.setframerate(frecuencia)
+                for inicio in range(0, total, BLOQUE_RENDER):
+                    fin = min(inicio + BLOQUE_RENDER, total)
+                    pcm = np.frombuffer(entrada.readframes(fin - inicio), dtype='<i2').reshape(-1, canales)
+                    indices = np.arange(inicio, inicio + len(pcm), dtype=np.float64)
+                    envolvente = (ganancia or 1.0) * np.minimum(1.0, indices / frames_in) \
+                        * np.minimum(1.0, (total - indices) / frames_out)
+                    bloque = np.clip(pcm * envolvente[:, None], -32768, 32767).astype('<i2')
+                    salida.writeframes(bloque.tobytes())
+        os.replace(temporal, destino)
+        print(f"[RENDER] ✓ {os.path.basename(ruta_audio)} -> {os.path.basename(destino)}")
+        return destino
+    finally:
+        for ruta in (temporal, decodificado):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+def solicitar_render(audio, ganancia, fade_in, fade_out, duracion_max):
+    """Encola el render en segundo plano para que esté listo antes de que suene la alarma"""
+    if np is None or not requiere_render(ganancia, fade_in, fade_out):
+        return
+    ruta_audio = os.path.join(ruta_audios(), os.path.basename(audio))
+    clave = (ruta_audio, ganancia, fade_in, fade_out, duracion_max)
+    with _renders_lock:
+        if clave in _renders_pendientes:
+            return
+        _renders_pendientes.add(clave)
+
+    def tarea():
+        try:
+            if os.path.exists(ruta_audio):
+                renderizar_audio(*clave)
+        except Exception as e:
+            print(f"[RENDER] ERROR al renderizar {os.path.basename(ruta_audio)}: {e}")
+        finally:
+            with _renders_lock:
+                _renders_pendientes.discard(clave)
+    _renderizador.submit(tarea)
+
+def renderizar_alarmas_de_audio(nombre):
+    """Encola de nuevo los renders de las alarmas que usan un audio cuyo contenido cambió"""
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT audio, ganancia, fade_in, fade_out, duracion_max FROM alarmas")
+    filas = cursor.fetchall()
+    conn.close()
+    for audio, ganancia, fade_in, fade_out, duracion_max in filas:
+        if audio and os.path.basename(audio) == nombre:
+            solicitar_render(audio, ganancia, fade_in, fade_out, duracion_max)
+
+def audio_renderizado(ruta_audio, ganancia, fade_in, fade_out, duracion_max):
+    """Ruta del render listo para esta alarma, o None para reproducir el original"""
+    if np is None or not requiere_render(ganancia, fade_in, fade_out):
+        return None
+    destino = ruta_render(ruta_audio, ganancia, fade_in, fade_out, duracion_max)
+    if os.path.exists(destino):
+        return destino
+    print(f"[RENDER] Render aún no disponible para {os.path.basename(ruta_audio)}, se usa el original")
+    solicitar_render(ruta_audio, ganancia, fade_in, fade_out, duracion_max)
+    return None
+
+def renders_vigentes(alarmas):
+    """Rutas de render que corresponden a las filas (.., audio, .., duracion_max, fade_out, fade_in, ganancia)"""
+    vigentes = set()
+    if np is None:
+        return vigentes
+    for _, _, audio, _, _, duracion_max, fade_out, fade_in, ganancia in alarmas:
+        ruta_audio = os.path.join(ruta_audios(), os.path.basename(audio))
+        if requiere_render(ganancia, fade_in, fade_out) and os.path.exists(ruta_audio):
+            vigentes.add(ruta_render(ruta_audio, ganancia, fade_in, fade_out, duracion_max))
+    return vigentes
+
+def limpiar_renders(vigentes):
+    """Borra renders que ya no corresponden a ninguna alarma"""
+    carpeta = ruta_renders()
+    if not os.path.exists(carpeta):
+        return
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        # Los temporales pertenecen a un render en curso
+        if ruta in vigentes or nombre.endswith(('.tmp', '.pcm.wav')):
+            continue
+        try:
+            os.remove(ruta)
+            print(f"[RENDER] Render sin uso eliminado: {nombre}")
+        except OSError as e:
+            print(f"[RENDER] No se pudo eliminar {nombre}: {e}")
+
+def reproducir_audio(audio_path, alarma_id=None, duracion_max=None, fade_out=None, fade_in=None, ganancia=None):
     sistema = platform.system().lower()
-    if sistema == "windows":
-        base_audio = "c:\\orangeClock\\audios"
-    else:
-        base_audio = "/orangeClock/audios"
+    base_audio = ruta_audios()
     
     print(f"[AUDIO] === INICIANDO REPRODUCCIÓN ===")
     print(f"[AUDIO] Sistema: {sistema}")
@@ -216,39 +512,50 @@ def reproducir_audio(audio_path):
         mostrar_mensaje_flotante("Error de Alarma", f"No se pudo reproducir el audio: {nombre_archivo}\nMotivo: {error_msg}", "error")
         return False
     
+    sesion = _iniciar_sesion(audio_path, alarma_id, duracion_max, fade_out, fade_in, ganancia)
+    print(f"[AUDIO] Sesión de reproducción: {sesion['id']}")
     try:
+        # Si la alarma tiene ganancia o rampas, reproducir el render ya calculado
+        ruta_render_lista = audio_renderizado(ruta_final, ganancia, fade_in, fade_out, duracion_max)
+        if ruta_render_lista:
+            print(f"[AUDIO] Usando render precalculado: {ruta_render_lista}")
+            ruta_final = ruta_render_lista
         if sistema == "windows":
             if not pygame.mixer.get_init():
                 pygame.mixer.init()
             pygame.mixer.music.load(ruta_final)
             pygame.mixer.music.play()
+            sesion['reproductor'] = 'pygame'
             print(f"[AUDIO] ✓ Iniciando pygame para: {nombre_archivo}")
             print(f"[AUDIO] ✓ Reproduciendo con pygame...")
             mostrar_mensaje_flotante("Alarma Ejecutada", f"Se ha reproducido correctamente el audio: {nombre_archivo}")
             print(f"[AUDIO] ✓ Mensaje flotante enviado")
-            time.sleep(10)
-            print(f"[AUDIO] ✓ Reproducción pygame completada")
+            motivo = _esperar_reproduccion(sesion, pygame.mixer.music.get_busy)
+            if motivo != 'fin':
+                if sesion['fade_out']:
+                    pygame.mixer.music.fadeout(int(sesion['fade_out'] * 1000))
+                    sesion['detener'].clear()
+                    _esperar_reproduccion(sesion, pygame.mixer.music.get_busy)
+                pygame.mixer.music.stop()
+            print(f"[AUDIO] ✓ Reproducción pygame completada ({motivo})")
             return True
         else:
             ext = os.path.splitext(ruta_final)[1].lower()
             
             if ext == ".mp3" and shutil.which("mpg123"):
-                result = subprocess.run(["mpg123", "-q", ruta_final], capture_output=True)
-                if result.returncode == 0:
+                if _reproducir_con_proceso(sesion, ["mpg123", "-q", ruta_final]):
                     print(f"[CRON] ✓ Reproducido con mpg123: {nombre_archivo}")
                     mostrar_mensaje_flotante("Alarma Ejecutada", f"Se ha reproducido correctamente el audio: {nombre_archivo}")
                     return True
             
             if ext == ".wav" and shutil.which("aplay"):
-                result = subprocess.run(["aplay", "-q", ruta_final], capture_output=True)
-                if result.returncode == 0:
+                if _reproducir_con_proceso(sesion, ["aplay", "-q", ruta_final]):
                     print(f"[CRON] ✓ Reproducido con aplay: {nombre_archivo}")
                     mostrar_mensaje_flotante("Alarma Ejecutada", f"Se ha reproducido correctamente el audio: {nombre_archivo}")
                     return True
             
-            if shutil.which("paplay"):
-                result = subprocess.run(["paplay", ruta_final], capture_output=True)
-                if result.returncode == 0:
+            if shutil.which("paplay") and not sesion['detener'].is_set():
+                if _reproducir_con_proceso(sesion, ["paplay", ruta_final]):
                     print(f"[CRON] ✓ Reproducido con paplay: {nombre_archivo}")
                     mostrar_mensaje_flotante("Alarma Ejecutada", f"Se ha reproducido correctamente el audio: {nombre_archivo}")
                     return True
@@ -263,6 +570,159 @@ def reproducir_audio(audio_path):
         print(f"[CRON] ERROR al reproducir audio: {e}")
         mostrar_mensaje_flotante("Error de Alarma", f"No se pudo reproducir el audio: {nombre_archivo}\nMotivo: {error_msg}", "error")
         return False
+    finally:
+        _finalizar_sesion(sesion)
+
+# Excepciones (feriados): fechas o rangos en que una alarma, o todas (alarma_id NULL), no suenan.
+# Se guardan en la tabla excepciones y se cargan en intervalos ordenados y fusionados por alarma,
+# de modo que cada disparo consulta con bisect en O(log n).
+_excepciones = {}  # alarma_id (None = global) -> (inicios, fines) de intervalos disjuntos
+
+def recargar_excepciones():
+    global _excepciones
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT alarma_id, desde, hasta FROM excepciones")
+    filas = cursor.fetchall()
+    conn.close()
+    rangos = {}
+    for alarma_id, desde, hasta in filas:
+        rangos.setdefault(alarma_id, []).append((date.fromisoformat(desde), date.fromisoformat(hasta)))
+    indice = {}
+    for alarma_id, lista in rangos.items():
+        # Ordenar por fecha ya interpretada (no por el texto guardado) y fusionar rangos
+        # solapados o contiguos para que la búsqueda sea un solo bisect
+        inicios, fines = indice[alarma_id] = ([], [])
+        for desde, hasta in sorted(lista):
+            if fines and desde <= fines[-1] + timedelta(days=1):
+                fines[-1] = max(fines[-1], hasta)
+            else:
+                inicios.append(desde)
+                fines.append(hasta)
+    _excepciones = indice
+    print(f"[INIT] Excepciones cargadas: {len(filas)} rangos")
+
+def fecha_exceptuada(alarma_id, dia):
+    """True si el día cae en una excepción global o de la alarma"""
+    indice = _excepciones
+    for clave in (None, alarma_id):
+        intervalos = indice.get(clave)
+        if intervalos:
+            inicios, fines = intervalos
+            i = bisect.bisect_right(inicios, dia) - 1
+            if i >= 0 and dia <= fines[i]:
+                return True
+    return False
+
+def omitir_por_excepcion(alarma_id):
+    hoy = hora_actual().date()
+    if fecha_exceptuada(alarma_id, hoy):
+        print(f"[CRON] Alarma {alarma_id} omitida: {hoy} es una fecha exceptuada")
+        return True
+    return False
+
+def programar_alarma(id, hora, audio, repeticion, fecha, duracion_max=None, fade_out=None, fade_in=None, ganancia=None):
+    """Programa (o reprograma) el job de una alarma guardada; devuelve True si quedó programada"""
+    base_audio = ruta_audios()
+    # Quitar el job anterior con el mismo id, si existe
+    try:
+        scheduler.remove_job(str(id))
+    except JobLookupError:
+        pass
+
+    # Verificar que el archivo de audio existe
+    nombre_archivo = os.path.basename(audio)
+    ruta_audio = os.path.join(base_audio, nombre_archivo)
+    if not os.path.exists(ruta_audio):
+        print(f"[INIT] ADVERTENCIA: Audio no encontrado para alarma {id}: {ruta_audio}")
+        return False
+    solicitar_render(audio, ganancia, fade_in, fade_out, duracion_max)
+
+    @en_ejecucion
+    def ejecutar_alarma(audio_path=audio, alarma_id=id, alarma_hora=hora, alarma_rep=repeticion, alarma_fecha=fecha,
+                        alarma_duracion=duracion_max, alarma_fade=fade_out, alarma_fade_in=fade_in,
+                        alarma_ganancia=ganancia):
+        from datetime import datetime
+        if omitir_por_excepcion(alarma_id):
+            return
+        print(f"[CRON] ========== EJECUTANDO ALARMA ===========")
+        print(f"[CRON] ID: {alarma_id}")
+        print(f"[CRON] Hora programada: {alarma_hora}")
+        print(f"[CRON] Audio: {audio_path}")
+        print(f"[CRON] Repetición: {alarma_rep}")
+        print(f"[CRON] Fecha: {alarma_fecha}")
+        print(f"[CRON] Timestamp actual: {hora_actual()}")
+
+        try:
+            resultado = reproducir_audio(audio_path, alarma_id, alarma_duracion, alarma_fade,
+                                         alarma_fade_in, alarma_ganancia)
+            if resultado:
+                print(f"[CRON] ✓ Alarma {alarma_id} ejecutada exitosamente")
+            else:
+                print(f"[CRON] ✗ Alarma {alarma_id} falló en reproducción")
+        except Exception as e:
+            print(f"[CRON] ✗ ERROR CRITICO en alarma {alarma_id}: {e}")
+            import traceback
+            traceback.print_exc()
+
+        print(f"[CRON] ========== FIN ALARMA {alarma_id} ==========")
+
+    try:
+        if fecha and fecha != 'None':
+            # Alarma de única vez
+            from datetime import datetime
+            run_date = f"{fecha} {hora}"
+            fecha_alarma = datetime.strptime(run_date, "%Y-%m-%d %H:%M")
+            # Solo programar si la fecha es futura
+            if fecha_alarma > hora_actual():
+                scheduler.add_job(
+                    ejecutar_alarma,
+                    'date',
+                    run_date=fecha_alarma,
+                    id=str(id)
+                )
+                print(f"[INIT] Alarma única programada: {id} - {fecha} {hora}")
+                return True
+            else:
+                print(f"[INIT] Alarma única pasada, no programada: {id} - {fecha} {hora}")
+                return False
+        elif repeticion and repeticion != 'None':
+            # Alarmas recurrentes
+            cron_kwargs = {
+                'hour': int(hora.split(':')[0]),
+                'minute': int(hora.split(':')[1]),
+                'id': str(id)
+            }
+            # Semanal (ej: mon, tue-wed)
+            dias_semana = ['mon','tue','wed','thu','fri','sat','sun']
+            if all(d in dias_semana for d in repeticion.split('-')):
+                # Convertir guiones a comas para APScheduler
+                cron_kwargs['day_of_week'] = repeticion.replace('-', ',')
+            # Anual (MM-DD)
+            elif len(repeticion) == 5 and repeticion[2] == '-':
+                mes, dia = repeticion.split('-')
+                cron_kwargs['month'] = int(mes)
+                cron_kwargs['day'] = int(dia)
+            # Mensual (día del mes)
+            elif repeticion.isdigit():
+                cron_kwargs['day'] = int(repeticion)
+            scheduler.add_job(ejecutar_alarma, 'cron', **cron_kwargs)
+            print(f"[INIT] Alarma recurrente programada: {id} - {hora} ({repeticion})")
+            return True
+        else:
+            # Alarma diaria
+            scheduler.add_job(
+                ejecutar_alarma,
+                'cron',
+                hour=int(hora.split(':')[0]),
+                minute=int(hora.split(':')[1]),
+                id=str(id)
+            )
+            print(f"[INIT] Alarma diaria programada: {id} - {hora}")
+            return True
+    except Exception as e:
+        print(f"[INIT] ERROR al cargar alarma id={id}, hora={hora}, audio={audio}, rep={repeticion}, fecha={fecha}: {e}")
+        return False
 
 def cargar_alarmas():
     print("[INIT] Iniciando carga de alarmas...")
@@ -275,7 +735,8 @@ def cargar_alarmas():
     # 1. Limpiar todos los jobs existentes
     try:
         for job in scheduler.get_jobs():
-            scheduler.remove_job(job.id)
+            if job.id != ID_LATIDO:
+                scheduler.remove_job(job.id)
         print(f"[INIT] Jobs limpiados: {len(scheduler.get_jobs())}")
     except Exception as e:
         print(f"[INIT] Error al limpiar jobs: {e}")
@@ -288,113 +749,30 @@ def cargar_alarmas():
     conn = sqlite3.connect('alarmas.db')
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, hora, audio, repeticion, fecha FROM alarmas")
+        cursor.execute("SELECT id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia FROM alarmas")
         alarmas = cursor.fetchall()
     except Exception as e:
         print(f"[INIT] Error al leer columna fecha, usando formato anterior: {e}")
         cursor.execute("SELECT id, hora, audio, repeticion FROM alarmas")
-        alarmas = [(id, hora, audio, repeticion, None) for id, hora, audio, repeticion in cursor.fetchall()]
+        alarmas = [(id, hora, audio, repeticion, None, None, None, None, None) for id, hora, audio, repeticion in cursor.fetchall()]
     conn.close()
 
     print(f"[INIT] Encontradas {len(alarmas)} alarmas en la base de datos")
     
     # 3. Verificar directorio de audios
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        base_audio = "c:\\orangeClock\\audios"
-    else:
-        base_audio = "/orangeClock/audios"
+    base_audio = ruta_audios()
     
     if not os.path.exists(base_audio):
         print(f"[INIT] Creando directorio de audios: {base_audio}")
         os.makedirs(base_audio, exist_ok=True)
 
     alarmas_cargadas = 0
-    for id, hora, audio, repeticion, fecha in alarmas:
-        # Verificar que el archivo de audio existe
-        nombre_archivo = os.path.basename(audio)
-        ruta_audio = os.path.join(base_audio, nombre_archivo)
-        if not os.path.exists(ruta_audio):
-            print(f"[INIT] ADVERTENCIA: Audio no encontrado para alarma {id}: {ruta_audio}")
-            continue
-            
-        def ejecutar_alarma(audio_path=audio, alarma_id=id, alarma_hora=hora, alarma_rep=repeticion, alarma_fecha=fecha):
-            from datetime import datetime
-            print(f"[CRON] ========== EJECUTANDO ALARMA ===========")
-            print(f"[CRON] ID: {alarma_id}")
-            print(f"[CRON] Hora programada: {alarma_hora}")
-            print(f"[CRON] Audio: {audio_path}")
-            print(f"[CRON] Repetición: {alarma_rep}")
-            print(f"[CRON] Fecha: {alarma_fecha}")
-            print(f"[CRON] Timestamp actual: {datetime.now()}")
-            
-            try:
-                resultado = reproducir_audio(audio_path)
-                if resultado:
-                    print(f"[CRON] ✓ Alarma {alarma_id} ejecutada exitosamente")
-                else:
-                    print(f"[CRON] ✗ Alarma {alarma_id} falló en reproducción")
-            except Exception as e:
-                print(f"[CRON] ✗ ERROR CRITICO en alarma {alarma_id}: {e}")
-                import traceback
-                traceback.print_exc()
-            
-            print(f"[CRON] ========== FIN ALARMA {alarma_id} ==========")
-            
-        try:
-            if fecha and fecha != 'None':
-                # Alarma de única vez
-                from datetime import datetime
-                run_date = f"{fecha} {hora}"
-                fecha_alarma = datetime.strptime(run_date, "%Y-%m-%d %H:%M")
-                # Solo programar si la fecha es futura
-                if fecha_alarma > datetime.now():
-                    scheduler.add_job(
-                        ejecutar_alarma,
-                        'date',
-                        run_date=fecha_alarma,
-                        id=str(id)
-                    )
-                    alarmas_cargadas += 1
-                    print(f"[INIT] Alarma única programada: {id} - {fecha} {hora}")
-                else:
-                    print(f"[INIT] Alarma única pasada, no programada: {id} - {fecha} {hora}")
-            elif repeticion and repeticion != 'None':
-                # Alarmas recurrentes
-                cron_kwargs = {
-                    'hour': int(hora.split(':')[0]),
-                    'minute': int(hora.split(':')[1]),
-                    'id': str(id)
-                }
-                # Semanal (ej: mon, tue-wed)
-                dias_semana = ['mon','tue','wed','thu','fri','sat','sun']
-                if all(d in dias_semana for d in repeticion.split('-')):
-                    # Convertir guiones a comas para APScheduler
-                    cron_kwargs['day_of_week'] = repeticion.replace('-', ',')
-                # Anual (MM-DD)
-                elif len(repeticion) == 5 and repeticion[2] == '-':
-                    mes, dia = repeticion.split('-')
-                    cron_kwargs['month'] = int(mes)
-                    cron_kwargs['day'] = int(dia)
-                # Mensual (día del mes)
-                elif repeticion.isdigit():
-                    cron_kwargs['day'] = int(repeticion)
-                scheduler.add_job(ejecutar_alarma, 'cron', **cron_kwargs)
-                alarmas_cargadas += 1
-                print(f"[INIT] Alarma recurrente programada: {id} - {hora} ({repeticion})")
-            else:
-                # Alarma diaria
-                scheduler.add_job(
-                    ejecutar_alarma,
-                    'cron',
-                    hour=int(hora.split(':')[0]),
-                    minute=int(hora.split(':')[1]),
-                    id=str(id)
-                )
-                alarmas_cargadas += 1
-                print(f"[INIT] Alarma diaria programada: {id} - {hora}")
-        except Exception as e:
-            print(f"[INIT] ERROR al cargar alarma id={id}, hora={hora}, audio={audio}, rep={repeticion}, fecha={fecha}: {e}")
+    for id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia in alarmas:
+        if programar_alarma(id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia):
+            alarmas_cargadas += 1
+    limpiar_renders(renders_vigentes(alarmas))
+    # Los jobs cambiaron: /api/ocurrencias y las demás lecturas cacheadas deben recalcularse
+    invalidar_cache('alarmas')
     
     print(f"[INIT] Carga completada: {alarmas_cargadas}/{len(alarmas)} alarmas programadas")
     print(f"[INIT] Jobs activos en scheduler: {len(scheduler.get_jobs())}")
@@ -409,16 +787,107 @@ def cargar_alarmas():
     else:
         print(f"[INIT] ⚠️  NO HAY JOBS ACTIVOS EN EL SCHEDULER")
 
-# Inicializar sistema completo
-inicializar_sistema()
+# Cache de respuestas ya serializadas para los endpoints de lectura.
+# Cada entrada pertenece a un grupo ('alarmas' o 'audios') que invalidan las rutas
+# que modifican esos datos; la generación evita guardar una respuesta calculada
+# antes de una modificación concurrente.
+_cache_respuestas = {}
+_cache_generacion = {'alarmas': 0, 'audios': 0}
+_cache_lock = threading.Lock()
+MAX_ENTRADAS_CACHE = 64  # tope de memoria; al llenarse se descarta la entrada más antigua
+
+def invalidar_cache(grupo):
+    """Descarta las respuestas cacheadas de un grupo tras una modificación"""
+    with _cache_lock:
+        _cache_generacion[grupo] += 1
+        for clave in [c for c in _cache_respuestas if c[0] == grupo]:
+            del _cache_respuestas[clave]
+
+def respuesta_cacheada(grupo, expiracion=None, parametros=()):
+    """Cachea los bytes JSON de un endpoint GET por endpoint y parámetros de consulta.
+
+    parametros son los nombres de la query string que la vista lee; el resto se ignora
+    para que parámetros arbitrarios no creen entradas nuevas. expiracion, si se indica,
+    es una función que recibe el instante actual (timestamp) y devuelve hasta cuándo es
+    válida la respuesta.
+    """
+    from functools import wraps
+
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            clave = (grupo, request.endpoint, tuple(sorted(kwargs.items())),
+                     tuple((nombre, request.args.get(nombre)) for nombre in parametros))
+            ahora_ts = hora_actual().timestamp()
+            with _cache_lock:
+                entrada = _cache_respuestas.get(clave)
+                generacion = _cache_generacion[grupo]
+            if entrada is not None and (entrada[3] is None or ahora_ts < entrada[3]):
+                cuerpo, status, mimetype, _ = entrada
+                return app.response_class(cuerpo, status=status, mimetype=mimetype)
+
+            respuesta = app.make_response(vista(*args, **kwargs))
+            if respuesta.status_code == 200:
+                expira = expiracion(ahora_ts) if expiracion else None
+                with _cache_lock:
+                    if _cache_generacion[grupo] == generacion:
+                        if clave not in _cache_respuestas and len(_cache_respuestas) >= MAX_ENTRADAS_CACHE:
+                            del _cache_respuestas[next(iter(_cache_respuestas))]
+                        _cache_respuestas[clave] = (respuesta.get_data(), respuesta.status_code,
+                                                    respuesta.mimetype, expira)
+            return respuesta
+        return envoltura
+    return decorador
+
+def hasta_proximo_minuto(ahora_ts):
+    """Las alarmas tienen resolución de minutos: la ventana de 24h solo cambia al cruzar un minuto"""
+    return (int(ahora_ts) // 60 + 1) * 60
+
+def leer_segundos(datos, campo):
+    """Lee un campo opcional en segundos (entero positivo o null)"""
+    valor = datos.get(campo)
+    if valor in (None, '', 'None'):
+        return None
+    try:
+        segundos = int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"El campo '{campo}' debe ser un número entero de segundos")
+    if segundos <= 0:
+        raise ValueError(f"El campo '{campo}' debe ser mayor que cero")
+    return segundos
+
+GANANCIA_MAXIMA = 4.0
+
+def leer_ganancia(datos):
+    """Lee la ganancia opcional (factor lineal entre 0 y GANANCIA_MAXIMA, o null)"""
+    valor = datos.get('ganancia')
+    if valor in (None, '', 'None'):
+        return None
+    try:
+        ganancia = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError("El campo 'ganancia' debe ser un número")
+    if not 0 < ganancia <= GANANCIA_MAXIMA:
+        raise ValueError(f"El campo 'ganancia' debe estar entre 0 y {GANANCIA_MAXIMA:g}")
+    return ganancia
 
 @app.route('/api/crear_alarma', methods=['POST'])
 def crear_alarma():
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
     datos = request.json
     hora = datos.get('hora')
     audio = datos.get('audio')
     repeticion = datos.get('repeticion')
     fecha = datos.get('fecha')
+    try:
+        duracion_max = leer_segundos(datos, 'duracion_max')
+        fade_out = leer_segundos(datos, 'fade_out')
+        fade_in = leer_segundos(datos, 'fade_in')
+        ganancia = leer_ganancia(datos)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     logger.info(f"[API] === CREANDO NUEVA ALARMA ===")
     logger.info(f"[API] Datos recibidos: {datos}")
@@ -465,66 +934,27 @@ def crear_alarma():
     # Guardar en la base de datos (ahora sí guarda fecha si aplica)
     # conn ya está abierta desde la verificación anterior
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO alarmas (hora, audio, repeticion, fecha) VALUES (?, ?, ?, ?)", (hora, audio, repeticion, fecha))
+    cursor.execute("INSERT INTO alarmas (hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                   (hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia))
+    alarma_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    invalidar_cache('alarmas')
+    notificar_cambio('u', alarma_id)
 
-    # Programar la alarma en apscheduler
-    def ejecutar_alarma():
-        from datetime import datetime
-        logger.info(f"[API-EXEC] ========== EJECUTANDO ALARMA NUEVA ===========")
-        logger.info(f"[API-EXEC] Hora: {hora}, Audio: {audio}, Repetición: {repeticion}")
-        logger.info(f"[API-EXEC] Timestamp: {datetime.now()}")
-        reproducir_audio(audio)
-        logger.info(f"[API-EXEC] ========== FIN ALARMA NUEVA ===========")
-
-    if fecha and fecha != 'None':  # Alarma de única vez
-        from datetime import datetime
-        run_date = f"{fecha} {hora}"
-        scheduler.add_job(
-            ejecutar_alarma,
-            'date',
-            run_date=datetime.strptime(run_date, "%Y-%m-%d %H:%M")
-        )
-    elif repeticion and repeticion != 'None':
-        # Alarmas recurrentes
-        cron_kwargs = {
-            'hour': int(hora.split(':')[0]),
-            'minute': int(hora.split(':')[1])
-        }
-        
-        # Semanal (ej: mon, tue-wed)
-        dias_semana = ['mon','tue','wed','thu','fri','sat','sun']
-        if all(d in dias_semana for d in repeticion.split('-')):
-            # Convertir guiones a comas para APScheduler
-            cron_kwargs['day_of_week'] = repeticion.replace('-', ',')
-        # Anual (MM-DD)
-        elif len(repeticion) == 5 and repeticion[2] == '-':
-            mes, dia = repeticion.split('-')
-            cron_kwargs['month'] = int(mes)
-            cron_kwargs['day'] = int(dia)
-        # Mensual (día del mes)
-        elif repeticion.isdigit():
-            cron_kwargs['day'] = int(repeticion)
-        
-        scheduler.add_job(ejecutar_alarma, 'cron', **cron_kwargs)
-    else:
-        # Alarma diaria
-        scheduler.add_job(
-            ejecutar_alarma, 
-            'cron', 
-            hour=int(hora.split(':')[0]), 
-            minute=int(hora.split(':')[1])
-        )
+    # Programar la alarma en apscheduler (mismas validaciones que al cargar desde la base)
+    programar_alarma(alarma_id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia)
 
     logger.info(f"[API] Jobs totales en scheduler: {len(scheduler.get_jobs())}")
     logger.info(f"[API] === ALARMA CREADA EXITOSAMENTE ===")
     
     print(f"[API] Jobs totales en scheduler: {len(scheduler.get_jobs())}", flush=True)
     print(f"[API] === ALARMA CREADA EXITOSAMENTE ===", flush=True)
-    return jsonify({"mensaje": f"Alarma programada para {hora} con repetición '{repeticion}' y guardada en el sistema"}), 201
+    return jsonify({"mensaje": f"Alarma programada para {hora} con repetición '{repeticion}' y guardada en el sistema", "id": alarma_id}), 201
 
 @app.route('/api/consultar_alarmas', methods=['GET'])
+@respuesta_cacheada('alarmas')
 def consultar_alarmas():
     conn = sqlite3.connect('alarmas.db')
     cursor = conn.cursor()
@@ -539,10 +969,11 @@ def consultar_alarmas():
         'sun': 'Domingo'
     }
     try:
-        cursor.execute("SELECT id, hora, audio, repeticion, fecha FROM alarmas ORDER BY hora")
+        cursor.execute("SELECT id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia "
+                       "FROM alarmas ORDER BY hora")
         alarmas = cursor.fetchall()
         resultado = []
-        for id, hora, audio, repeticion, fecha in alarmas:
+        for id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia in alarmas:
             rep_es = repeticion
             if repeticion and all(d in dias_semana for d in repeticion.split('-')):
                 rep_es = '-'.join([dias_semana_es[d] for d in repeticion.split('-')])
@@ -551,7 +982,11 @@ def consultar_alarmas():
                 "hora": hora,
                 "audio": audio,
                 "repeticion": rep_es,
-                "fecha": fecha
+                "fecha": fecha,
+                "duracion_max": duracion_max,
+                "fade_out": fade_out,
+                "fade_in": fade_in,
+                "ganancia": ganancia
             })
     except Exception:
         cursor.execute("SELECT id, hora, audio, repeticion FROM alarmas ORDER BY hora")
@@ -573,6 +1008,9 @@ def consultar_alarmas():
 
 @app.route('/api/eliminar_alarma/<int:alarma_id>', methods=['DELETE'])
 def eliminar_alarma(alarma_id):
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
     conn = sqlite3.connect('alarmas.db')
     cursor = conn.cursor()
 
@@ -586,8 +1024,14 @@ def eliminar_alarma(alarma_id):
 
     # Eliminar de la base de datos
     cursor.execute("DELETE FROM alarmas WHERE id=?", (alarma_id,))
+    cursor.execute("DELETE FROM excepciones WHERE alarma_id=?", (alarma_id,))
+    excepciones_borradas = cursor.rowcount
     conn.commit()
     conn.close()
+    if excepciones_borradas:
+        recargar_excepciones()
+    invalidar_cache('alarmas')
+    notificar_cambio('d', alarma_id)
 
     # Eliminar de apscheduler si está activa
     for job in scheduler.get_jobs():
@@ -598,6 +1042,9 @@ def eliminar_alarma(alarma_id):
 
 @app.route('/api/editar_alarma/<int:alarma_id>', methods=['PUT'])
 def editar_alarma(alarma_id):
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
     datos = request.json
     nueva_hora = datos.get('hora')
     nuevo_audio = datos.get('audio')
@@ -606,6 +1053,13 @@ def editar_alarma(alarma_id):
 
     if not nueva_hora or not nuevo_audio:
         return jsonify({"mensaje": "Se requieren los campos 'hora' y 'audio'"}), 400
+    try:
+        nueva_duracion = leer_segundos(datos, 'duracion_max')
+        nuevo_fade = leer_segundos(datos, 'fade_out')
+        nuevo_fade_in = leer_segundos(datos, 'fade_in')
+        nueva_ganancia = leer_ganancia(datos)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Conexión a la base de datos
     conn = sqlite3.connect('alarmas.db')
@@ -620,60 +1074,18 @@ def editar_alarma(alarma_id):
         return jsonify({"error": f"No se encontró una alarma con ID {alarma_id}"}), 404
 
     # Actualizar en la base de datos
-    cursor.execute("UPDATE alarmas SET hora=?, audio=?, repeticion=?, fecha=? WHERE id=?", (nueva_hora, nuevo_audio, nueva_repeticion, nueva_fecha, alarma_id))
+    cursor.execute("UPDATE alarmas SET hora=?, audio=?, repeticion=?, fecha=?, duracion_max=?, fade_out=?, "
+                   "fade_in=?, ganancia=? WHERE id=?",
+                   (nueva_hora, nuevo_audio, nueva_repeticion, nueva_fecha, nueva_duracion, nuevo_fade,
+                    nuevo_fade_in, nueva_ganancia, alarma_id))
     conn.commit()
     conn.close()
+    invalidar_cache('alarmas')
+    notificar_cambio('u', alarma_id)
 
-    # Eliminar el trabajo anterior en APScheduler, si existe
-    for job in scheduler.get_jobs():
-        if job.id == str(alarma_id):
-            scheduler.remove_job(job.id)
-
-    # Programar la nueva alarma en APScheduler
-    def ejecutar_alarma():
-        reproducir_audio(nuevo_audio)
-
-    if nueva_fecha and nueva_fecha != 'None':  # Alarma de única vez
-        from datetime import datetime
-        run_date = f"{nueva_fecha} {nueva_hora}"
-        scheduler.add_job(
-            ejecutar_alarma,
-            'date',
-            run_date=datetime.strptime(run_date, "%Y-%m-%d %H:%M"),
-            id=str(alarma_id)
-        )
-    elif nueva_repeticion and nueva_repeticion != 'None':
-        # Alarmas recurrentes
-        cron_kwargs = {
-            'hour': int(nueva_hora.split(':')[0]),
-            'minute': int(nueva_hora.split(':')[1]),
-            'id': str(alarma_id)
-        }
-        
-        # Semanal (ej: mon, tue-wed)
-        dias_semana = ['mon','tue','wed','thu','fri','sat','sun']
-        if all(d in dias_semana for d in nueva_repeticion.split('-')):
-            # Convertir guiones a comas para APScheduler
-            cron_kwargs['day_of_week'] = nueva_repeticion.replace('-', ',')
-        # Anual (MM-DD)
-        elif len(nueva_repeticion) == 5 and nueva_repeticion[2] == '-':
-            mes, dia = nueva_repeticion.split('-')
-            cron_kwargs['month'] = int(mes)
-            cron_kwargs['day'] = int(dia)
-        # Mensual (día del mes)
-        elif nueva_repeticion.isdigit():
-            cron_kwargs['day'] = int(nueva_repeticion)
-        
-        scheduler.add_job(ejecutar_alarma, 'cron', **cron_kwargs)
-    else:
-        # Alarma diaria
-        scheduler.add_job(
-            ejecutar_alarma, 
-            'cron', 
-            hour=int(nueva_hora.split(':')[0]), 
-            minute=int(nueva_hora.split(':')[1]), 
-            id=str(alarma_id)
-        )
+    # Reprogramar en APScheduler (reemplaza el trabajo anterior, si existe)
+    programar_alarma(alarma_id, nueva_hora, nuevo_audio, nueva_repeticion, nueva_fecha, nueva_duracion,
+                     nuevo_fade, nuevo_fade_in, nueva_ganancia)
 
     return jsonify({"mensaje": f"Alarma con ID {alarma_id} actualizada y reprogramada correctamente"}), 200
 
@@ -695,15 +1107,15 @@ def subir_audio():
         if not allowed_audio(file.filename):
             return jsonify({'error': 'Formato no permitido'}), 400
         # Guardar en la ruta orangeClock
-        sistema = platform.system().lower()
-        if sistema == "windows":
-            audio_folder = "c:\\orangeClock\\audios"
-        else:
-            audio_folder = "/orangeClock/audios"
+        audio_folder = ruta_audios()
         if not os.path.exists(audio_folder):
             os.makedirs(audio_folder)
         filename = secure_filename(file.filename)
         file.save(os.path.join(audio_folder, filename))
+        # Si reemplazó un audio existente, sus renders (clave por hash) quedaron obsoletos
+        renderizar_alarmas_de_audio(filename)
+        invalidar_cache('audios')
+        despertar_difusion()
         return jsonify({'mensaje': 'Audio guardado', 'ruta': filename}), 201
     except Exception as e:
         print(f"Error al subir audio: {e}")
@@ -711,12 +1123,9 @@ def subir_audio():
 
 # Cambia la función listar_audios para leer desde la ruta orangeClock
 @app.route('/api/audios', methods=['GET'])
+@respuesta_cacheada('audios')
 def listar_audios():
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        carpeta_audios = "c:\\orangeClock\\audios"
-    else:
-        carpeta_audios = "/orangeClock/audios"
+    carpeta_audios = ruta_audios()
     if not os.path.exists(carpeta_audios):
         return jsonify([])
     archivos = []
@@ -731,37 +1140,25 @@ def listar_audios():
 # Servir archivos de audio estaticamente
 @app.route('/api/audios/<path:filename>')
 def servir_audio(filename):
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        carpeta_audios = "c:\\orangeClock\\audios"
-    else:
-        carpeta_audios = "/orangeClock/audios"
+    carpeta_audios = ruta_audios()
     return send_from_directory(carpeta_audios, filename)
 
 # Cambia eliminar y renombrar audio para usar la ruta orangeClock
 @app.route('/api/audios/<nombre>', methods=['DELETE'])
 def eliminar_audio(nombre):
-    import platform
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        audio_folder = "c:\\orangeClock\\audios"
-    else:
-        audio_folder = "/orangeClock/audios"
+    audio_folder = ruta_audios()
     filename = secure_filename(nombre)
     path = os.path.join(audio_folder, filename)
     if os.path.exists(path):
         os.remove(path)
+        invalidar_cache('audios')
+        despertar_difusion()
         return jsonify({'mensaje': 'Audio eliminado'}), 200
     return jsonify({'error': 'Audio no encontrado'}), 404
 
 @app.route('/api/audios/<nombre>', methods=['PUT'])
 def renombrar_audio(nombre):
-    import platform
-    sistema = platform.system().lower()
-    if sistema == "windows":
-        audio_folder = "c:\\orangeClock\\audios"
-    else:
-        audio_folder = "/orangeClock/audios"
+    audio_folder = ruta_audios()
     data = request.json
     nuevo_nombre = secure_filename(data.get('nuevo_nombre', ''))
     if not nuevo_nombre:
@@ -775,9 +1172,143 @@ def renombrar_audio(nombre):
     if os.path.exists(new_path):
         return jsonify({'error': 'Ya existe un audio con ese nombre'}), 400
     os.rename(old_path, new_path)
+    invalidar_cache('audios')
+    despertar_difusion()
     return jsonify({'mensaje': 'Audio renombrado', 'ruta': f'/audios/{nuevo_nombre_completo}'}), 200
 
+@app.route('/api/excepciones', methods=['GET'])
+def listar_excepciones():
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    alarma_id = request.args.get('alarma_id', type=int)
+    if alarma_id is not None:
+        cursor.execute("SELECT id, alarma_id, desde, hasta, motivo FROM excepciones WHERE alarma_id=? ORDER BY desde", (alarma_id,))
+    else:
+        cursor.execute("SELECT id, alarma_id, desde, hasta, motivo FROM excepciones ORDER BY desde")
+    resultado = [{"id": id, "alarma_id": a_id, "desde": desde, "hasta": hasta, "motivo": motivo}
+                 for id, a_id, desde, hasta, motivo in cursor.fetchall()]
+    conn.close()
+    return jsonify({"excepciones": resultado}), 200
+
+@app.route('/api/excepciones', methods=['POST'])
+def crear_excepcion():
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
+    datos = request.json
+    desde = datos.get('desde')
+    hasta = datos.get('hasta') or desde
+    alarma_id = datos.get('alarma_id')
+    try:
+        # Guardar siempre YYYY-MM-DD aunque llegue en otra forma ISO (p. ej. 20260110)
+        desde = date.fromisoformat(desde).isoformat()
+        hasta = date.fromisoformat(hasta).isoformat()
+        if hasta < desde:
+            return jsonify({'error': "'hasta' no puede ser anterior a 'desde'"}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': "Se requiere 'desde' (y opcionalmente 'hasta') con formato YYYY-MM-DD"}), 400
+
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    if alarma_id is not None:
+        cursor.execute("SELECT id FROM alarmas WHERE id=?", (alarma_id,))
+        if not cursor.fetchone():
+            conn.close()
+            return jsonify({"error": f"No se encontró una alarma con ID {alarma_id}"}), 404
+    cursor.execute("INSERT INTO excepciones (alarma_id, desde, hasta, motivo) VALUES (?, ?, ?, ?)",
+                   (alarma_id, desde, hasta, datos.get('motivo')))
+    excepcion_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    recargar_excepciones()
+    invalidar_cache('alarmas')
+    despertar_difusion()
+    alcance = f"la alarma {alarma_id}" if alarma_id is not None else "todas las alarmas"
+    return jsonify({"mensaje": f"Excepción del {desde} al {hasta} para {alcance}", "id": excepcion_id}), 201
+
+@app.route('/api/excepciones/<int:excepcion_id>', methods=['DELETE'])
+def eliminar_excepcion(excepcion_id):
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM excepciones WHERE id=?", (excepcion_id,))
+    eliminadas = cursor.rowcount
+    conn.commit()
+    conn.close()
+    if not eliminadas:
+        return jsonify({"error": f"No se encontró una excepción con ID {excepcion_id}"}), 404
+    recargar_excepciones()
+    invalidar_cache('alarmas')
+    despertar_difusion()
+    return jsonify({"mensaje": f"Excepción con ID {excepcion_id} eliminada correctamente"}), 200
+
+@app.route('/api/ocurrencias', methods=['GET'])
+@respuesta_cacheada('alarmas', expiracion=hasta_proximo_minuto, parametros=('dias',))
+def listar_ocurrencias():
+    """Próximos disparos reales según los triggers del scheduler, sin las fechas exceptuadas"""
+    dias = min(max(request.args.get('dias', 7, type=int), 1), 31)
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, hora, audio FROM alarmas")
+    alarmas = {str(id): (id, hora, audio) for id, hora, audio in cursor.fetchall()}
+    conn.close()
+
+    resultado = []
+    for job in scheduler.get_jobs():
+        if job.id not in alarmas or job.next_run_time is None:
+            continue
+        id, hora, audio = alarmas[job.id]
+        disparo = job.next_run_time
+        limite = hora_actual().replace(tzinfo=disparo.tzinfo) + timedelta(days=dias)
+        while disparo is not None and disparo <= limite:
+            if not fecha_exceptuada(id, disparo.date()):
+                resultado.append({"id": id, "fecha_hora": disparo.strftime("%Y-%m-%d %H:%M"), "audio": audio})
+            disparo = job.trigger.get_next_fire_time(disparo, disparo)
+    resultado.sort(key=lambda x: x['fecha_hora'])
+    return jsonify({"ocurrencias": resultado}), 200
+
+@app.route('/api/playback', methods=['GET'])
+def listar_reproducciones():
+    with _sesiones_lock:
+        sesiones = [sesion_a_dict(s) for s in _sesiones.values()]
+    return jsonify({"reproducciones": sesiones}), 200
+
+@app.route('/api/playback/<sesion_id>/stop', methods=['POST'])
+def detener_reproduccion(sesion_id):
+    sesion = detener_sesion(sesion_id)
+    if sesion is None:
+        return jsonify({"error": f"No hay una reproducción activa con ID {sesion_id}"}), 404
+    return jsonify({"mensaje": f"Reproducción {sesion_id} detenida"}), 200
+
+@app.route('/api/playback/<sesion_id>/snooze', methods=['POST'])
+def posponer_reproduccion(sesion_id):
+    datos = request.get_json(silent=True) or {}
+    try:
+        minutos = int(datos.get('minutos', POSPONER_MINUTOS_DEFECTO))
+    except (TypeError, ValueError):
+        return jsonify({"error": "El campo 'minutos' debe ser un número entero"}), 400
+    if minutos <= 0:
+        return jsonify({"error": "El campo 'minutos' debe ser mayor que cero"}), 400
+
+    sesion = detener_sesion(sesion_id, 'pospuesta')
+    if sesion is None:
+        return jsonify({"error": f"No hay una reproducción activa con ID {sesion_id}"}), 404
+
+    run_date = hora_actual() + timedelta(minutes=minutos)
+    scheduler.add_job(
+        en_ejecucion(reproducir_audio),
+        'date',
+        run_date=run_date,
+        args=[sesion['audio'], sesion['alarma_id'], sesion['duracion_max'], sesion['fade_out'],
+              sesion['fade_in'], sesion['ganancia']],
+        id=f"posponer-{sesion_id}"
+    )
+    return jsonify({"mensaje": f"Reproducción {sesion_id} pospuesta hasta {run_date.strftime('%H:%M')}"}), 200
+
 @app.route('/api/alarmas_proximas', methods=['GET'])
+@respuesta_cacheada('alarmas', expiracion=hasta_proximo_minuto)
 def alarmas_proximas():
     conn = sqlite3.connect('alarmas.db')
     cursor = conn.cursor()
@@ -789,7 +1320,7 @@ def alarmas_proximas():
         alarmas = [(id, hora, audio, repeticion, None) for id, hora, audio, repeticion in cursor.fetchall()]
     conn.close()
 
-    ahora = datetime.now()
+    ahora = hora_actual()
     dentro_24h = ahora + timedelta(hours=24)
     resultado = []
     dias_semana = ['mon','tue','wed','thu','fri','sat','sun']
@@ -807,7 +1338,7 @@ def alarmas_proximas():
         if fecha and fecha != 'None':
             try:
                 dt_alarma = datetime.strptime(f"{fecha} {hora}", "%Y-%m-%d %H:%M")
-                if ahora <= dt_alarma <= dentro_24h:
+                if ahora <= dt_alarma <= dentro_24h and not fecha_exceptuada(id, dt_alarma.date()):
                     resultado.append({"id": id, "hora": hora, "audio": audio, "repeticion": repeticion, "fecha": fecha})
             except Exception:
                 continue
@@ -819,7 +1350,7 @@ def alarmas_proximas():
                 hoy_idx = ahora.weekday()
                 dias_hasta = (idx_dia - hoy_idx) % 7
                 dt_alarma = ahora.replace(hour=int(hora.split(":")[0]), minute=int(hora.split(":")[1]), second=0, microsecond=0) + timedelta(days=dias_hasta)
-                if ahora <= dt_alarma <= dentro_24h:
+                if ahora <= dt_alarma <= dentro_24h and not fecha_exceptuada(id, dt_alarma.date()):
                     resultado.append({"id": id, "hora": hora, "audio": audio, "repeticion": rep_es, "fecha": None})
                     break
         # Alarmas anuales (MM-DD)
@@ -830,25 +1361,731 @@ def alarmas_proximas():
                 # Si la fecha ya pasó este año, calcula para el próximo año
                 if dt_alarma < ahora:
                     dt_alarma = dt_alarma.replace(year=ahora.year + 1)
-                if ahora <= dt_alarma <= dentro_24h:
+                if ahora <= dt_alarma <= dentro_24h and not fecha_exceptuada(id, dt_alarma.date()):
                     resultado.append({"id": id, "hora": hora, "audio": audio, "repeticion": repeticion, "fecha": None})
             except Exception:
                 continue
+        # Alarmas mensuales (día del mes): solo pueden caer hoy o mañana dentro de la ventana
+        elif repeticion and repeticion != 'None' and repeticion.isdigit():
+            for dias in (0, 1):
+                dt_alarma = ahora.replace(hour=int(hora.split(":")[0]), minute=int(hora.split(":")[1]), second=0, microsecond=0) + timedelta(days=dias)
+                if dt_alarma.day == int(repeticion) and ahora <= dt_alarma <= dentro_24h and not fecha_exceptuada(id, dt_alarma.date()):
+                    resultado.append({"id": id, "hora": hora, "audio": audio, "repeticion": repeticion, "fecha": None})
+                    break
         # Alarmas diarias (sin repetición ni fecha)
         elif not repeticion and not fecha:
             dt_alarma = ahora.replace(hour=int(hora.split(":")[0]), minute=int(hora.split(":")[1]), second=0, microsecond=0)
             if dt_alarma < ahora:
                 dt_alarma += timedelta(days=1)
-            if ahora <= dt_alarma <= dentro_24h:
+            if ahora <= dt_alarma <= dentro_24h and not fecha_exceptuada(id, dt_alarma.date()):
                 resultado.append({"id": id, "hora": hora, "audio": audio, "repeticion": None, "fecha": None})
     
     # Ordenar por hora
     resultado.sort(key=lambda x: x['hora'])
     return jsonify({"alarmas_proximas": resultado}), 200
 
+# === Monitor del scheduler: latido, retraso y saturación, con watchdog de systemd ===
+# Un job de latido corre cada LATIDO_SEGUNDOS en el mismo pool que las alarmas y mide cuánto
+# tarda en empezar respecto de su hora programada. Si el hilo del scheduler muere o el pool se
+# atasca, el latido deja de llegar; mientras el scheduler esté sano se notifica WATCHDOG=1 a
+# systemd (WatchdogSec en orangeclock.service), que reinicia el servicio si la notificación cesa.
+ID_LATIDO = '__latido__'
+LATIDO_SEGUNDOS = 5
+LAG_MAXIMO = float(os.environ.get('ORANGECLOCK_LAG_MAXIMO', 10))
+_monitor = {
+    'inicio': time.monotonic(),
+    'ultimo_latido': None,
+    'programado': None,
+    'lag': None,
+    'lag_maximo': 0.0,
+    'en_curso': 0,
+    'pico_en_curso': 0,
+    'perdidos': 0,
+    'rechazados': 0
+}
+_monitor_lock = threading.Lock()
+
+def en_ejecucion(funcion):
+    """Envuelve un job de alarma para contar los hilos del pool que ocupa mientras corre.
+
+    Se cuenta dentro del propio job (y no por pares de eventos del scheduler) porque un job
+    encolado que vence su tiempo de gracia en el executor solo emite EVENT_JOB_MISSED.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with _monitor_lock:
+            _monitor['en_curso'] += 1
+            _monitor['pico_en_curso'] = max(_monitor['pico_en_curso'], _monitor['en_curso'])
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            with _monitor_lock:
+                _monitor['en_curso'] -= 1
+    return envoltura
+
+def _evento_scheduler(evento):
+    """Registra la hora programada del latido y cuenta jobs perdidos por misfire o rechazados por max_instances"""
+    with _monitor_lock:
+        if evento.code == EVENT_JOB_SUBMITTED:
+            if evento.job_id == ID_LATIDO:
+                _monitor['programado'] = evento.scheduled_run_times[-1]
+        elif evento.code == EVENT_JOB_MISSED:
+            _monitor['perdidos'] += 1
+            print(f"[MONITOR] Job {evento.job_id} perdido (misfire) a las {evento.scheduled_run_time}")
+        elif evento.code == EVENT_JOB_MAX_INSTANCES:
+            _monitor['rechazados'] += 1
+            if evento.job_id != ID_LATIDO:
+                print(f"[MONITOR] Job {evento.job_id} no se ejecutó: instancias máximas en curso")
+
+def latido():
+    """Job de latido: registra el retraso entre la hora programada y la ejecución real"""
+    with _monitor_lock:
+        programado = _monitor['programado']
+        if programado is not None:
+            lag = max((datetime.now(programado.tzinfo) - programado).total_seconds(), 0.0)
+            _monitor['lag'] = lag
+            _monitor['lag_maximo'] = max(_monitor['lag_maximo'], lag)
+        _monitor['ultimo_latido'] = time.monotonic()
+
+def salud_scheduler():
+    """Estado del scheduler; 'sano' es False si no corre, no late, va retrasado o el pool está lleno"""
+    with _monitor_lock:
+        estado = dict(_monitor)
+    referencia = estado.pop('ultimo_latido') or estado['inicio']
+    del estado['inicio'], estado['programado']
+    estado['segundos_sin_latido'] = round(time.monotonic() - referencia, 1)
+    estado['hilos'] = HILOS_SCHEDULER
+    estado['saturacion'] = round(estado['en_curso'] / HILOS_SCHEDULER, 2)
+    with _sesiones_lock:
+        estado['reproducciones'] = len(_sesiones)
+    problemas = []
+    if not scheduler.running:
+        problemas.append("scheduler detenido")
+    if estado['segundos_sin_latido'] > LATIDO_SEGUNDOS * 3:
+        problemas.append(f"sin latido hace {estado['segundos_sin_latido']:.0f} s")
+    if estado['lag'] is not None and estado['lag'] > LAG_MAXIMO:
+        problemas.append(f"retraso de {estado['lag']:.1f} s")
+    if estado['en_curso'] >= HILOS_SCHEDULER:
+        problemas.append("pool de ejecución saturado")
+    estado['sano'] = not problemas
+    estado['problemas'] = problemas
+    return estado
+
+def sd_notify(mensaje):
+    """Envía un mensaje a systemd por NOTIFY_SOCKET; no hace nada fuera de systemd"""
+    direccion = os.environ.get('NOTIFY_SOCKET')
+    if not direccion or not hasattr(socket, 'AF_UNIX'):
+        return False
+    if direccion.startswith('@'):
+        direccion = '\0' + direccion[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(direccion)
+            s.sendall(mensaje.encode())
+        return True
+    except OSError as e:
+        print(f"[MONITOR] Error al notificar a systemd: {e}")
+        return False
+
+def bucle_watchdog(intervalo):
+    sano_anterior = True
+    while True:
+        estado = salud_scheduler()
+        if estado['sano']:
+            sd_notify("WATCHDOG=1")
+            if not sano_anterior:
+                print("[MONITOR] ✓ Scheduler recuperado")
+                sd_notify("STATUS=Scheduler sano")
+        elif sano_anterior:
+            print(f"[MONITOR] ✗ Scheduler con problemas, se retiene el watchdog: {', '.join(estado['problemas'])}")
+            sd_notify(f"STATUS=Scheduler con problemas: {', '.join(estado['problemas'])}")
+        sano_anterior = estado['sano']
+        time.sleep(intervalo)
+
+def iniciar_monitor():
+    """Programa el latido y, si systemd lo pide (WATCHDOG_USEC), arranca el hilo del watchdog"""
+    scheduler.add_listener(_evento_scheduler, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+    scheduler.add_job(latido, 'interval', seconds=LATIDO_SEGUNDOS, id=ID_LATIDO, replace_existing=True,
+                      next_run_time=datetime.now(), misfire_grace_time=None, coalesce=True)
+    sd_notify("READY=1")
+    watchdog_usec = os.environ.get('WATCHDOG_USEC')
+    if watchdog_usec:
+        intervalo = int(watchdog_usec) / 1e6 / 2
+        threading.Thread(target=bucle_watchdog, args=(intervalo,), daemon=True).start()
+        print(f"[MONITOR] Watchdog de systemd activo, notificando cada {intervalo:.1f} s")
+
+@app.route('/api/salud', methods=['GET'])
+def salud():
+    estado = salud_scheduler()
+    return jsonify(estado), 200 if estado['sano'] else 503
+
+# === Modo multi-nodo: un controlador difunde el horario a agentes de reproducción ===
+# ORANGECLOCK_MODO=controlador|agente. El controlador es dueño de la tabla alarmas y lista sus
+# agentes en ORANGECLOCK_AGENTES (URLs separadas por comas); cada agente indica su controlador
+# en ORANGECLOCK_CONTROLADOR para descargar los audios. ORANGECLOCK_TOKEN, si se define en
+# ambos lados, autentica los envíos.
+MODO_NODO = os.environ.get('ORANGECLOCK_MODO', '').lower()
+AGENTES = [u.strip().rstrip('/') for u in os.environ.get('ORANGECLOCK_AGENTES', '').split(',') if u.strip()]
+CONTROLADOR = os.environ.get('ORANGECLOCK_CONTROLADOR', '').rstrip('/')
+TOKEN_NODOS = os.environ.get('ORANGECLOCK_TOKEN', '')
+CAMBIOS_RETENIDOS = 1000      # deltas guardados; un agente más atrasado recibe el horario completo
+INTERVALO_REINTENTO = 30      # segundos entre reintentos a agentes que fallaron
+_evento_difusion = threading.Event()
+_estado_agentes = {}
+_sincronizacion_lock = threading.Lock()
+_hashes_archivo = {}
+
+def hash_archivo(ruta):
+    """SHA-256 del archivo, recalculado solo si cambian su tamaño o fecha de modificación"""
+    st = os.stat(ruta)
+    firma = (st.st_mtime_ns, st.st_size)
+    cacheado = _hashes_archivo.get(ruta)
+    if cacheado and cacheado[0] == firma:
+        return cacheado[1]
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(65536), b''):
+            h.update(bloque)
+    _hashes_archivo[ruta] = (firma, h.hexdigest())
+    return h.hexdigest()
+
+def catalogo_audios():
+    """{nombre: sha256} de los audios disponibles en este nodo"""
+    carpeta = ruta_audios()
+    if not os.path.exists(carpeta):
+        return {}
+    return {n: hash_archivo(os.path.join(carpeta, n)) for n in sorted(os.listdir(carpeta)) if allowed_audio(n)}
+
+def notificar_cambio(operacion, alarma_id):
+    """Registra el cambio de una alarma para difundirlo a los agentes (solo en modo controlador)"""
+    if MODO_NODO != 'controlador':
+        return
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO cambios (alarma_id, operacion) VALUES (?, ?)", (alarma_id, operacion))
+    cursor.execute("DELETE FROM cambios WHERE version <= ?", (cursor.lastrowid - CAMBIOS_RETENIDOS,))
+    conn.commit()
+    conn.close()
+    _evento_difusion.set()
+
+def despertar_difusion():
+    """Audios y excepciones viajan completos en cada envío; basta con despertar la difusión"""
+    if MODO_NODO == 'controlador':
+        _evento_difusion.set()
+
+def construir_paquete(version_agente, audios, excepciones):
+    """Horario para un agente: deltas desde su versión si siguen retenidos, si no el horario completo.
+
+    Las filas viajan como listas [id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia].
+    """
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(version), 0), COALESCE(MIN(version), 1) FROM cambios")
+    version, minima = cursor.fetchone()
+    columnas = "id, hora, audio, repeticion, fecha, duracion_max, fade_out, fade_in, ganancia"
+    paquete = {"version": version, "desde": version_agente, "audios": audios, "excepciones": excepciones}
+    if version_agente is None or version_agente > version or version_agente < minima - 1:
+        cursor.execute(f"SELECT {columnas} FROM alarmas")
+        paquete["completo"] = True
+        paquete["alarmas"] = [list(fila) for fila in cursor.fetchall()]
+    else:
+        # Varios cambios de la misma alarma se agrupan en su estado actual
+        cursor.execute("SELECT DISTINCT alarma_id FROM cambios WHERE version > ?", (version_agente,))
+        ids = [fila[0] for fila in cursor.fetchall()]
+        filas = []
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            cursor.execute(f"SELECT {columnas} FROM alarmas WHERE id IN ({','.join('?' * len(lote))})", lote)
+            filas += cursor.fetchall()
+        existentes = {fila[0] for fila in filas}
+        paquete["completo"] = False
+        paquete["cambios"] = [['u'] + list(fila) for fila in filas] + [['d', i] for i in ids if i not in existentes]
+    conn.close()
+    return paquete
+
+def _post_json(url, cuerpo):
+    """POST de un cuerpo JSON ya comprimido con gzip; devuelve (status, json)"""
+    req = urllib.request.Request(url, data=cuerpo, method='POST', headers={
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip',
+        'X-OrangeClock-Token': TOKEN_NODOS
+    })
+    try:
+        with urllib.request.urlopen(req, timeout=15) as r:
+            return r.status, json.loads(r.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'{}')
+        except ValueError:
+            return e.code, {}
+
+def _get_json(url):
+    req = urllib.request.Request(url, headers={'X-OrangeClock-Token': TOKEN_NODOS})
+    with urllib.request.urlopen(req, timeout=15) as r:
+        return json.loads(r.read() or b'{}')
+
+def difundir():
+    """Envía en paralelo a cada agente lo que le falta; agentes en la misma versión comparten el paquete"""
+    audios = catalogo_audios()
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT alarma_id, desde, hasta, motivo FROM excepciones ORDER BY id")
+    excepciones = [list(fila) for fila in cursor.fetchall()]
+    conn.close()
+    # Firma de lo que viaja completo en cada envío: si no cambió, un agente al día no recibe nada
+    firma = hashlib.sha256(json.dumps([audios, excepciones], sort_keys=True).encode()).hexdigest()
+    paquetes = {}
+    paquetes_lock = threading.Lock()
+
+    def paquete_para(version_agente):
+        with paquetes_lock:
+            if version_agente not in paquetes:
+                paquete = construir_paquete(version_agente, audios, excepciones)
+                paquetes[version_agente] = (paquete["version"], gzip.compress(
+                    json.dumps(paquete, separators=(',', ':')).encode()))
+            return paquetes[version_agente]
+
+    def sincronizar(url):
+        estado = _estado_agentes.setdefault(url, {"version": None, "firma": None, "ultimo_ok": None, "error": None})
+        version_actual, cuerpo = paquete_para(estado["version"])
+        if estado["version"] == version_actual and estado["firma"] == firma:
+            # Al día según lo último enviado: confirmar que el agente lo sigue teniendo, porque un
+            # agente reinstalado o con la base o los audios borrados no avisa por sí mismo
+            try:
+                reportado = _get_json(f"{url}/api/agente/estado")
+            except Exception as e:
+                estado["error"] = str(e)
+                print(f"[NODOS] ✗ Agente {url}: {estado['error']}")
+                return
+            audios_agente = reportado.get("audios") or {}
+            if (reportado.get("version") == version_actual
+                    and all(audios_agente.get(n) == h for n, h in audios.items())):
+                estado["error"] = None
+                return
+            print(f"[NODOS] Agente {url} desincronizado (versión {reportado.get('version')}), "
+                  f"se envía el horario completo")
+            estado.update(version=None, firma=None)
+            version_actual, cuerpo = paquete_para(None)
+        try:
+            status, respuesta = _post_json(f"{url}/api/agente/sync", cuerpo)
+            if status == 409:
+                # El agente no está en la versión esperada: enviar el horario completo
+                version_actual, cuerpo = paquete_para(None)
+                status, respuesta = _post_json(f"{url}/api/agente/sync", cuerpo)
+            if status == 200:
+                estado.update(version=respuesta.get("version"), firma=firma,
+                              ultimo_ok=hora_actual().strftime("%Y-%m-%d %H:%M:%S"), error=None)
+            else:
+                estado["error"] = respuesta.get("error", f"HTTP {status}")
+        except Exception as e:
+            estado["error"] = str(e)
+        if estado["error"]:
+            print(f"[NODOS] ✗ Agente {url}: {estado['error']}")
+
+    with ThreadPoolExecutor(max_workers=min(16, len(AGENTES)) or 1) as ejecutor:
+        list(ejecutor.map(sincronizar, AGENTES))
+
+def bucle_difusion():
+    while True:
+        _evento_difusion.wait(timeout=INTERVALO_REINTENTO)
+        time.sleep(0.5)  # agrupar ráfagas de cambios en un solo envío
+        _evento_difusion.clear()
+        try:
+            difundir()
+        except Exception as e:
+            print(f"[NODOS] ERROR al difundir horario: {e}")
+
+def iniciar_difusion():
+    print(f"[NODOS] Modo controlador: {len(AGENTES)} agentes")
+    thread = threading.Thread(target=bucle_difusion)
+    thread.daemon = True
+    thread.start()
+    _evento_difusion.set()
+
+def rechazar_en_agente():
+    """En un agente las alarmas solo cambian por sincronización con el controlador"""
+    if MODO_NODO == 'agente':
+        return jsonify({'error': 'Este nodo es un agente: las alarmas se gestionan desde el controlador'}), 409
+    return None
+
+def leer_version_local():
+    conn = sqlite3.connect('alarmas.db')
+    cursor = conn.cursor()
+    cursor.execute("SELECT valor FROM sincronizacion WHERE clave='version'")
+    fila = cursor.fetchone()
+    conn.close()
+    return int(fila[0]) if fila else None
+
+def sincronizar_audios(catalogo):
+    """Trae del controlador los audios cuyo hash no coincide; reutiliza copias locales con el mismo contenido"""
+    carpeta = ruta_audios()
+    os.makedirs(carpeta, exist_ok=True)
+    locales = catalogo_audios()
+    por_hash = {h: n for n, h in locales.items()}
+    nuevos = 0
+    for nombre, esperado in catalogo.items():
+        nombre = secure_filename(nombre)
+        if locales.get(nombre) == esperado:
+            continue
+        destino = os.path.join(carpeta, nombre)
+        temporal = destino + '.sync'
+        if esperado in por_hash:
+            shutil.copyfile(os.path.join(carpeta, por_hash[esperado]), temporal)
+        else:
+            h = hashlib.sha256()
+            with urllib.request.urlopen(f"{CONTROLADOR}/api/audios/{urllib.parse.quote(nombre)}", timeout=60) as r, \
+                    open(temporal, 'wb') as f:
+                for bloque in iter(lambda: r.read(65536), b''):
+                    h.update(bloque)
+                    f.write(bloque)
+            if h.hexdigest() != esperado:
+                os.remove(temporal)
+                raise ValueError(f"Hash incorrecto al descargar {nombre}")
+        os.replace(temporal, destino)
+        por_hash[esperado] = nombre
+        nuevos += 1
+    return nuevos
+
+@app.route('/api/agente/sync', methods=['POST'])
+def recibir_horario():
+    if MODO_NODO != 'agente':
+        return jsonify({'error': 'Este nodo no está en modo agente'}), 409
+    if TOKEN_NODOS and request.headers.get('X-OrangeClock-Token') != TOKEN_NODOS:
+        return jsonify({'error': 'Token inválido'}), 403
+    cuerpo = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        cuerpo = gzip.decompress(cuerpo)
+    datos = json.loads(cuerpo)
+
+    with _sincronizacion_lock:
+        version_local = leer_version_local()
+        if not datos['completo'] and datos['desde'] != version_local:
+            return jsonify({'error': 'Versión desincronizada', 'version': version_local}), 409
+        try:
+            audios_nuevos = sincronizar_audios(datos['audios'])
+        except Exception as e:
+            print(f"[NODOS] ERROR al sincronizar audios: {e}")
+            return jsonify({'error': f'Error al sincronizar audios: {e}'}), 502
+
+        conn = sqlite3.connect('alarmas.db')
+        cursor = conn.cursor()
+        insertar = ("INSERT OR REPLACE INTO alarmas (id, hora, audio, repeticion, fecha, duracion_max, fade_out, "
+                    "fade_in, ganancia) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        if datos['completo']:
+            cursor.execute("DELETE FROM alarmas")
+            cursor.executemany(insertar, datos['alarmas'])
+        else:
+            for cambio in datos['cambios']:
+                if cambio[0] == 'u':
+                    cursor.execute(insertar, cambio[1:])
+                else:
+                    cursor.execute("DELETE FROM alarmas WHERE id=?", (cambio[1],))
+        cursor.execute("DELETE FROM excepciones")
+        cursor.executemany("INSERT INTO excepciones (alarma_id, desde, hasta, motivo) VALUES (?, ?, ?, ?)",
+                           datos.get('excepciones', []))
+        cursor.execute("INSERT OR REPLACE INTO sincronizacion (clave, valor) VALUES ('version', ?)", (str(datos['version']),))
+        conn.commit()
+        conn.close()
+        recargar_excepciones()
+
+        if datos['completo'] or audios_nuevos:
+            cargar_alarmas()
+        else:
+            for cambio in datos['cambios']:
+                if cambio[0] == 'u':
+                    programar_alarma(*cambio[1:])
+                else:
+                    try:
+                        scheduler.remove_job(str(cambio[1]))
+                    except JobLookupError:
+                        pass
+    invalidar_cache('alarmas')
+    if audios_nuevos:
+        invalidar_cache('audios')
+    print(f"[NODOS] Horario versión {datos['version']} aplicado ({'completo' if datos['completo'] else 'delta'}, {audios_nuevos} audios)")
+    return jsonify({'version': datos['version'], 'audios_nuevos': audios_nuevos}), 200
+
+@app.route('/api/agente/estado', methods=['GET'])
+def estado_agente():
+    """Lo que este agente tiene realmente, para que el controlador detecte desvíos"""
+    if MODO_NODO != 'agente':
+        return jsonify({'error': 'Este nodo no está en modo agente'}), 409
+    if TOKEN_NODOS and request.headers.get('X-OrangeClock-Token') != TOKEN_NODOS:
+        return jsonify({'error': 'Token inválido'}), 403
+    return jsonify({"version": leer_version_local(), "audios": catalogo_audios()}), 200
+
+@app.route('/api/nodos', methods=['GET'])
+def listar_nodos():
+    return jsonify({"modo": MODO_NODO or "independiente", "agentes": [
+        dict(url=url, **_estado_agentes.get(url, {"version": None, "ultimo_ok": None, "error": None}))
+        for url in AGENTES
+    ]}), 200
+
+@app.route('/api/nodos/sincronizar', methods=['POST'])
+def forzar_sincronizacion():
+    if MODO_NODO != 'controlador':
+        return jsonify({'error': 'Este nodo no está en modo controlador'}), 409
+    # Forzar el horario completo: no se confía en lo que se cree que cada agente tiene
+    for estado in _estado_agentes.values():
+        estado.update(version=None, firma=None)
+    _evento_difusion.set()
+    return jsonify({'mensaje': 'Sincronización solicitada'}), 202
+
+# === Respaldo y restauración en caliente de alarmas.db y del catálogo de audios ===
+# El respaldo es un único .tar.gz con la base copiada con la API de backup en línea de SQLite
+# (en pasos de PAGINAS_RESPALDO páginas, así las peticiones en curso no quedan bloqueadas),
+# un manifiesto {nombre: sha256} y cada contenido de audio una sola vez (objetos/<sha256>).
+PAGINAS_RESPALDO = 64
+ESPERA_RESTAURAR = 10  # segundos máximos esperando que la base en uso quede libre
+SQLITE_BUSY, SQLITE_LOCKED = 5, 6  # códigos de SQLite (sqlite3 solo los expone desde Python 3.11)
+VERSION_RESPALDO = 1
+_respaldo_lock = threading.Lock()
+
+def crear_respaldo(destino):
+    """Escribe el respaldo en destino y devuelve su manifiesto"""
+    base_audio = ruta_audios()
+    with _respaldo_lock, tempfile.TemporaryDirectory() as temporal:
+        ruta_db = os.path.join(temporal, 'alarmas.db')
+        origen = sqlite3.connect('alarmas.db')
+        copia = sqlite3.connect(ruta_db)
+        try:
+            origen.backup(copia, pages=PAGINAS_RESPALDO, sleep=0.005)
+        finally:
+            copia.close()
+            origen.close()
+
+        manifiesto = {
+            "version": VERSION_RESPALDO,
+            "creado": hora_actual().strftime("%Y-%m-%d %H:%M:%S"),
+            "audios": catalogo_audios()
+        }
+        contenido = json.dumps(manifiesto, indent=1).encode()
+        with tarfile.open(destino, 'w:gz') as tar:
+            info = tarfile.TarInfo('manifiesto.json')
+            info.size = len(contenido)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(contenido))
+            tar.add(ruta_db, arcname='alarmas.db')
+            agregados = set()
+            for nombre, hash_contenido in manifiesto["audios"].items():
+                if hash_contenido not in agregados:
+                    tar.add(os.path.join(base_audio, nombre), arcname=f"objetos/{hash_contenido}")
+                    agregados.add(hash_contenido)
+    print(f"[RESPALDO] ✓ Respaldo creado: {len(manifiesto['audios'])} audios ({len(agregados)} contenidos distintos)")
+    return manifiesto
+
+def _copiar_verificando(origen, destino, hash_esperado):
+    """Copia un archivo abierto a destino comprobando su sha256"""
+    h = hashlib.sha256()
+    with open(destino, 'wb') as salida:
+        for bloque in iter(lambda: origen.read(1 << 16), b''):
+            h.update(bloque)
+            salida.write(bloque)
+    if h.hexdigest() != hash_esperado:
+        raise ValueError(f"El contenido de {os.path.basename(destino)} no coincide con su hash")
+
+def restaurar_respaldo(origen):
+    """Restaura audios y base desde un respaldo; el estado en memoria se reconcilia aparte.
+
+    Todo se valida y prepara antes de tocar nada: los audios se escriben como temporales en la
+    carpeta de audios. Primero se copia la base sobre la base en uso con la API de backup en un
+    solo paso (para los demás lectores, una única transacción); solo si eso funciona se
+    reemplazan los audios con os.replace y se borran los que sobran. Si la base sigue ocupada
+    tras ESPERA_RESTAURAR segundos se lanza sqlite3.OperationalError y nada cambia.
+    """
+    base_audio = ruta_audios()
+    os.makedirs(base_audio, exist_ok=True)
+    preparados = []
+    with _respaldo_lock, tarfile.open(origen, 'r:gz') as tar, tempfile.TemporaryDirectory() as temporal:
+        try:
+            manifiesto = json.load(tar.extractfile('manifiesto.json'))
+        except (KeyError, ValueError):
+            raise ValueError("El archivo no es un respaldo de Orange Clock (falta manifiesto.json)")
+        if manifiesto.get("version") != VERSION_RESPALDO:
+            raise ValueError(f"Versión de respaldo no soportada: {manifiesto.get('version')}")
+
+        ruta_db = os.path.join(temporal, 'alarmas.db')
+        with tar.extractfile('alarmas.db') as f, open(ruta_db, 'wb') as salida:
+            shutil.copyfileobj(f, salida)
+        conn = sqlite3.connect(ruta_db)
+        try:
+            if conn.execute("PRAGMA integrity_check").fetchone()[0] != 'ok':
+                raise ValueError("La base de datos del respaldo está dañada")
+            conn.execute("SELECT id, hora, audio, repeticion FROM alarmas LIMIT 1")
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"La base de datos del respaldo no es válida: {e}")
+        finally:
+            conn.close()
+
+        actuales = catalogo_audios()
+        por_hash = {h: os.path.join(base_audio, n) for n, h in actuales.items()}
+        try:
+            for nombre, hash_contenido in manifiesto["audios"].items():
+                if secure_filename(nombre) != nombre or not allowed_audio(nombre):
+                    raise ValueError(f"Nombre de audio no permitido en el respaldo: {nombre}")
+                if actuales.get(nombre) == hash_contenido:
+                    continue
+                ruta_temporal = os.path.join(base_audio, f".restaurando-{nombre}")
+                preparados.append((ruta_temporal, os.path.join(base_audio, nombre)))
+                # Un contenido que ya está en este nodo (con otro nombre) no se extrae
+                if hash_contenido in por_hash:
+                    with open(por_hash[hash_contenido], 'rb') as f:
+                        _copiar_verificando(f, ruta_temporal, hash_contenido)
+                else:
+                    with tar.extractfile(f"objetos/{hash_contenido}") as f:
+                        _copiar_verificando(f, ruta_temporal, hash_contenido)
+            restaurada = sqlite3.connect(ruta_db)
+            viva = sqlite3.connect('alarmas.db', timeout=1)  # cada paso ocupado vuelve a esperar_base
+            limite = time.monotonic() + ESPERA_RESTAURAR
+
+            def esperar_base(estado, restantes, total):
+                # backup() reintenta sin fin mientras la base esté ocupada: acotar la espera
+                if estado in (SQLITE_BUSY, SQLITE_LOCKED) and time.monotonic() > limite:
+                    raise sqlite3.OperationalError(f"la base sigue ocupada tras {ESPERA_RESTAURAR} s")
+            try:
+                restaurada.backup(viva, progress=esperar_base)
+            finally:
+                viva.close()
+                restaurada.close()
+        except Exception:
+            for ruta_temporal, _ in preparados:
+                if os.path.exists(ruta_temporal):
+                    os.remove(ruta_temporal)
+            raise
+
+        for ruta_temporal, ruta_final in preparados:
+            os.replace(ruta_temporal, ruta_final)
+        for nombre in actuales:
+            if nombre not in manifiesto["audios"]:
+                try:
+                    os.remove(os.path.join(base_audio, nombre))
+                except OSError as e:
+                    print(f"[RESPALDO] No se pudo eliminar {nombre}: {e}")
+    print(f"[RESPALDO] ✓ Respaldo del {manifiesto.get('creado')} restaurado: "
+          f"{len(manifiesto['audios'])} audios, {len(preparados)} reemplazados")
+    return manifiesto
+
+def reconciliar_tras_restaurar():
+    """Recarga una sola vez todo lo que se deriva de la base y de los audios"""
+    inicializar_db()  # migra columnas si el respaldo es de una versión anterior
+    recargar_excepciones()
+    invalidar_cache('alarmas')
+    invalidar_cache('audios')
+    cargar_alarmas()
+    if MODO_NODO == 'controlador':
+        # La numeración de cambios restaurada no es comparable: enviar el horario completo
+        for estado in _estado_agentes.values():
+            estado["version"] = None
+        despertar_difusion()
+
+@app.route('/api/admin/backup', methods=['GET'])
+def descargar_respaldo():
+    if TOKEN_NODOS and request.headers.get('X-OrangeClock-Token') != TOKEN_NODOS:
+        return jsonify({'error': 'Token inválido'}), 403
+    descriptor, ruta = tempfile.mkstemp(suffix='.tar.gz')
+    os.close(descriptor)
+    try:
+        crear_respaldo(ruta)
+    except Exception as e:
+        os.remove(ruta)
+        print(f"[RESPALDO] ERROR al crear respaldo: {e}")
+        return jsonify({'error': f'Error al crear respaldo: {e}'}), 500
+    respuesta = send_file(ruta, mimetype='application/gzip', as_attachment=True,
+                          download_name=f"orangeclock-{hora_actual().strftime('%Y%m%d-%H%M')}.tar.gz")
+    respuesta.call_on_close(lambda: os.path.exists(ruta) and os.remove(ruta))
+    return respuesta
+
+@app.route('/api/admin/restore', methods=['POST'])
+def subir_respaldo():
+    rechazo = rechazar_en_agente()
+    if rechazo:
+        return rechazo
+    # Restaurar reemplaza la base y borra audios: sin token configurado queda deshabilitado
+    if not TOKEN_NODOS:
+        return jsonify({'error': 'Restauración deshabilitada: defina ORANGECLOCK_TOKEN en el servicio'}), 403
+    if request.headers.get('X-OrangeClock-Token') != TOKEN_NODOS:
+        return jsonify({'error': 'Token inválido'}), 403
+    descriptor, ruta = tempfile.mkstemp(suffix='.tar.gz')
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            if 'respaldo' in request.files:
+                request.files['respaldo'].save(f)
+            else:
+                shutil.copyfileobj(request.stream, f)
+        manifiesto = restaurar_respaldo(ruta)
+    except (ValueError, KeyError, tarfile.TarError, EOFError) as e:
+        return jsonify({'error': f'Respaldo inválido: {e}'}), 400
+    except sqlite3.Error as e:
+        print(f"[RESPALDO] ERROR al restaurar la base: {e}")
+        return jsonify({'error': f'No se pudo restaurar la base, no se modificó nada: {e}'}), 503
+    finally:
+        os.remove(ruta)
+    reconciliar_tras_restaurar()
+    return jsonify({
+        "mensaje": "Respaldo restaurado correctamente",
+        "creado": manifiesto.get("creado"),
+        "audios": len(manifiesto["audios"]),
+        "alarmas_programadas": len([j for j in scheduler.get_jobs() if j.id != ID_LATIDO])
+    }), 200
+
+# === Frontend servido por el backend (opcional) ===
+# Con ORANGECLOCK_FRONTEND=<carpeta del build> este proceso sirve también la interfaz, sin Caddy.
+# Los archivos precomprimidos por precompress-build.py (.br/.gz) se eligen según Accept-Encoding;
+# lo que está bajo static/ lleva hash en el nombre y se cachea como inmutable, el resto (index.html,
+# manifest...) se revalida con ETag. Las rutas sin extensión devuelven index.html (rutas de la SPA).
+FRONTEND = os.environ.get('ORANGECLOCK_FRONTEND', '')
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CODIFICACIONES = (('br', '.br'), ('gzip', '.gz'))
+
+def variante_frontend(ruta):
+    """(ruta del archivo a enviar, codificación) según lo que acepta el navegador.
+
+    Una variante más vieja que el original (build copiado de nuevo sin volver a precomprimir)
+    se ignora para no servir contenido anterior.
+    """
+    modificado = os.path.getmtime(ruta)
+    for codificacion, sufijo in CODIFICACIONES:
+        variante = ruta + sufijo
+        if (request.accept_encodings[codificacion] and os.path.isfile(variante)
+                and os.path.getmtime(variante) >= modificado):
+            return variante, codificacion
+    return ruta, None
+
+def servir_frontend(ruta):
+    if ruta.startswith('api/'):
+        return jsonify({'error': 'No encontrado'}), 404
+    archivo = safe_join(FRONTEND, ruta) if ruta else None
+    if not archivo or not os.path.isfile(archivo):
+        # Un archivo inexistente es 404; una ruta de la SPA se resuelve en el navegador
+        if '.' in os.path.basename(ruta):
+            return jsonify({'error': 'No encontrado'}), 404
+        archivo = os.path.join(FRONTEND, 'index.html')
+
+    enviado, codificacion = variante_frontend(archivo)
+    etag = hash_archivo(enviado)[:20] + (f"-{codificacion}" if codificacion else '')
+    inmutable = ruta.startswith('static/')
+    if request.if_none_match.contains(etag):
+        respuesta = app.response_class(status=304)
+    else:
+        tipo = mimetypes.guess_type(archivo)[0] or 'application/octet-stream'
+        respuesta = send_file(enviado, mimetype=tipo, conditional=False, etag=False, max_age=None)
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = CACHE_INMUTABLE if inmutable else 'no-cache'
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    return respuesta
+
+# Las rutas comodín solo existen en este modo; sin frontend, rutas desconocidas siguen dando 404
+if FRONTEND:
+    app.add_url_rule('/', 'servir_frontend', servir_frontend, defaults={'ruta': ''})
+    app.add_url_rule('/<path:ruta>', 'servir_frontend', servir_frontend)
+
 # iniciar api Flask tiene que ir al final del script
 if __name__ == '__main__':
     print("[MAIN] Iniciando servidor Flask...", flush=True)
     logger.info("[MAIN] Iniciando servidor Flask...")
+    # Inicializar sistema completo (fuera del import para que el arnés de simulación controle el arranque)
+    inicializar_sistema()
     #app.run(host='0.0.0.0', port=5000)
-    serve(app, host='0.0.0.0', port=5000)
+    serve(app, host='0.0.0.0', port=int(os.environ.get('ORANGECLOCK_PUERTO', 5000)))
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""Arnés de simulación (soak) para schedule-controller.py
+
+Carga el backend con un reloj simulado y un scheduler que usa los mismos triggers
+de APScheduler, reproductores y un tkinter simulados (la GUI real corre sobre él), y avanza semanas de alarmas en segundos.
+Durante la simulación crea, edita y elimina alarmas por la API, simula reinicios del
+servicio (cargar_alarmas) y al final comprueba que:
+
+  - cada ocurrencia esperada se ejecutó exactamente una vez (sin faltantes ni duplicadas)
+  - /api/alarmas_proximas y /api/ocurrencias coinciden con un cálculo independiente
+  - las excepciones (feriados globales o por alarma) silencian exactamente sus fechas
+  - hilos, descriptores abiertos y RSS no crecen con el tiempo simulado
+
+Uso:
+    python3 soak-harness.py --alarmas 400 --dias 28 --semilla 1
+"""
+import argparse
+import contextlib
+import heapq
+import importlib.util
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import types
+from datetime import datetime, timedelta, timezone, time as dtime
+
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+
+DIAS_SEMANA = ['mon','tue','wed','thu','fri','sat','sun']
+MISFIRE_GRACE = timedelta(seconds=1)  # valor por defecto de APScheduler
+
+def _utc(momento):
+    return momento.replace(tzinfo=timezone.utc)
+
+def _local(momento):
+    return momento.replace(tzinfo=None)
+
+class RelojSimulado:
+    """Reloj que solo avanza cuando el arnés lo indica"""
+    def __init__(self, inicio):
+        self._ahora = inicio
+        self._cond = threading.Condition()
+
+    def ahora(self):
+        with self._cond:
+            return self._ahora
+
+    def avanzar_hasta(self, momento):
+        with self._cond:
+            if momento > self._ahora:
+                self._ahora = momento
+                self._cond.notify_all()
+
+    def esperar_hasta(self, momento, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._ahora >= momento, timeout)
+
+class TrabajoSimulado:
+    def __init__(self, id, func, trigger, args, kwargs, next_run_time):
+        self.id = id
+        self.func = func
+        self.trigger = trigger
+        self.args = args
+        self.kwargs = kwargs
+        self.next_run_time = next_run_time
+
+class SchedulerSimulado:
+    """Sustituye al BackgroundScheduler: mismos triggers y errores de APScheduler, tiempo simulado"""
+    def __init__(self, reloj):
+        self.reloj = reloj
+        self.running = False
+        self.perdidos = 0
+        self._trabajos = {}
+        self._secuencia = 0
+
+    def start(self):
+        self.running = True
+
+    def add_job(self, func, trigger, args=None, kwargs=None, id=None, **trigger_args):
+        if id is None:
+            self._secuencia += 1
+            id = f"auto-{self._secuencia}"
+        if id in self._trabajos:
+            raise ConflictingIdError(id)
+        if trigger == 'date':
+            trig = DateTrigger(run_date=trigger_args['run_date'], timezone=timezone.utc)
+        elif trigger == 'cron':
+            trig = CronTrigger(timezone=timezone.utc, **trigger_args)
+        else:
+            raise ValueError(f"Trigger no soportado por el arnés: {trigger}")
+        next_run_time = trig.get_next_fire_time(None, _utc(self.reloj.ahora()))
+        if next_run_time is not None:
+            self._trabajos[id] = TrabajoSimulado(id, func, trig, args or [], kwargs or {}, next_run_time)
+        return self._trabajos.get(id)
+
+    def get_jobs(self):
+        return list(self._trabajos.values())
+
+    def remove_job(self, job_id):
+        if job_id not in self._trabajos:
+            raise JobLookupError(job_id)
+        del self._trabajos[job_id]
+
+    def ejecutar_hasta(self, limite):
+        """Ejecuta en orden todos los trabajos con disparo <= limite, avanzando el reloj a cada uno"""
+        limite = _utc(limite)
+        while self._trabajos:
+            trabajo = min(self._trabajos.values(), key=lambda t: t.next_run_time)
+            run_time = trabajo.next_run_time
+            if run_time > limite:
+                break
+            ahora = _utc(self.reloj.ahora())
+            self.reloj.avanzar_hasta(_local(run_time))
+            siguiente = trabajo.trigger.get_next_fire_time(run_time, max(run_time, ahora))
+            if siguiente is None:
+                del self._trabajos[trabajo.id]
+            else:
+                trabajo.next_run_time = siguiente
+            if ahora - run_time > MISFIRE_GRACE:
+                self.perdidos += 1
+                continue
+            trabajo.func(*trabajo.args, **trabajo.kwargs)
+
+class TkinterSimulado:
+    """Módulo tkinter falso para que corra el mostrar_mensaje_flotante real.
+
+    Tk.mainloop bloquea el hilo de la ventana y ejecuta los root.after() cuando el reloj
+    simulado llega a su hora; la ventana solo se cierra si el código de producción llama a
+    destroy(). Así, si una ventana nunca se cierra, su hilo sigue vivo y se ve en los recursos.
+    """
+    def __init__(self, reloj):
+        self.reloj = reloj
+        self.mensajes = {}
+        self._ventanas = []
+        self._lock = threading.Lock()
+        simulado = self
+
+        class Tk:
+            def __init__(self):
+                self.hilo = threading.current_thread()
+                self.destruida = False
+                self._pendientes = []  # heap de (momento, orden, funcion, args)
+                self._orden = 0
+                self._momento_actual = None
+                with simulado._lock:
+                    simulado._ventanas.append(self)
+
+            def title(self, titulo):
+                with simulado._lock:
+                    simulado.mensajes[titulo] = simulado.mensajes.get(titulo, 0) + 1
+
+            def after(self, milisegundos, funcion, *args):
+                base = self._momento_actual or simulado.reloj.ahora()
+                self._orden += 1
+                heapq.heappush(self._pendientes, (base + timedelta(milliseconds=milisegundos), self._orden,
+                                                  funcion, args))
+
+            def proximo(self):
+                return self._pendientes[0][0] if self._pendientes else None
+
+            def mainloop(self):
+                while not self.destruida:
+                    momento = self.proximo()
+                    if momento is None:
+                        simulado.reloj.esperar_hasta(datetime.max, timeout=1)
+                        continue
+                    if not simulado.reloj.esperar_hasta(momento, timeout=1):
+                        continue
+                    momento, _, funcion, args = heapq.heappop(self._pendientes)
+                    # after() dentro del callback cuenta desde su hora programada, como un Tk puntual
+                    self._momento_actual = momento
+                    funcion(*args)
+                    self._momento_actual = None
+
+            def destroy(self):
+                self.destruida = True
+
+            def winfo_screenwidth(self):
+                return 1024
+
+            def __getattr__(self, nombre):
+                # withdraw, deiconify, geometry, resizable, eval, configure, protocol...
+                return lambda *args, **kwargs: None
+
+        class Label:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __getattr__(self, nombre):
+                return lambda *args, **kwargs: None
+
+        self.modulo = types.ModuleType('tkinter')
+        self.modulo.Tk = Tk
+        self.modulo.Label = Label
+        self.modulo.messagebox = types.ModuleType('tkinter.messagebox')
+
+    def instalar(self):
+        sys.modules['tkinter'] = self.modulo
+        sys.modules['tkinter.messagebox'] = self.modulo.messagebox
+        os.environ['DISPLAY'] = ':99'
+
+    def recoger(self, espera=2):
+        """Espera a que terminen los hilos de ventanas ya destruidas o con callbacks vencidos"""
+        ahora = self.reloj.ahora()
+        with self._lock:
+            ventanas = list(self._ventanas)
+        for ventana in ventanas:
+            proximo = ventana.proximo()
+            if ventana.destruida or (proximo is not None and proximo <= ahora):
+                ventana.hilo.join(timeout=espera)
+        with self._lock:
+            self._ventanas = [v for v in self._ventanas if v.hilo.is_alive()]
+
+class ReproductorSimulado:
+    """Reemplaza _reproducir_con_proceso y registra cada disparo con su hora simulada"""
+    def __init__(self, modulo, reloj):
+        self.modulo = modulo
+        self.reloj = reloj
+        self.disparos = []
+        self.sesiones_no_registradas = 0
+
+    def __call__(self, sesion, comando):
+        if sesion['id'] not in self.modulo._sesiones:
+            self.sesiones_no_registradas += 1
+        sesion['reproductor'] = comando[0]
+        self.disparos.append((sesion['alarma_id'], self.reloj.ahora().replace(second=0, microsecond=0)))
+        return True
+
+def recursos():
+    """Hilos vivos, descriptores abiertos y RSS (kB) del proceso"""
+    hilos = threading.active_count()
+    try:
+        fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        fds = None
+    rss = None
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    rss = int(linea.split()[1])
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return hilos, fds, rss
+
+def coincide(spec, dia):
+    if spec['fecha']:
+        return dia.strftime("%Y-%m-%d") == spec['fecha']
+    rep = spec['repeticion']
+    if not rep:
+        return True
+    if all(d in DIAS_SEMANA for d in rep.split('-')):
+        return DIAS_SEMANA[dia.weekday()] in rep.split('-')
+    if rep.isdigit():
+        return dia.day == int(rep)
+    mes, d = map(int, rep.split('-'))
+    return (dia.month, dia.day) == (mes, d)
+
+def exceptuada(excepciones, alarma_id, dia):
+    return any(a in (None, alarma_id) and desde <= dia <= hasta for a, desde, hasta in excepciones)
+
+def ocurrencias(spec, desde, hasta, excepciones=(), alarma_id=None):
+    """Cálculo independiente de los disparos de una alarma en el intervalo (desde, hasta]"""
+    hh, mm = map(int, spec['hora'].split(':'))
+    dia = desde.date()
+    while dia <= hasta.date():
+        momento = datetime.combine(dia, dtime(hh, mm))
+        if desde < momento <= hasta and coincide(spec, dia) and not exceptuada(excepciones, alarma_id, dia):
+            yield momento
+        dia += timedelta(days=1)
+
+def generar_spec(rng, ahora, fin):
+    hora = f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"
+    tipo = rng.choices(['diaria', 'semanal', 'mensual', 'anual', 'unica'], weights=[2, 4, 2, 1, 2])[0]
+    dia_aleatorio = (ahora + timedelta(days=rng.randint(1, max(1, (fin - ahora).days)))).date()
+    if tipo == 'diaria':
+        return {'hora': hora, 'repeticion': None, 'fecha': None}
+    if tipo == 'semanal':
+        dias = sorted(rng.sample(DIAS_SEMANA, rng.randint(1, 5)), key=DIAS_SEMANA.index)
+        return {'hora': hora, 'repeticion': '-'.join(dias), 'fecha': None}
+    if tipo == 'mensual':
+        return {'hora': hora, 'repeticion': str(rng.randint(1, 31)), 'fecha': None}
+    if tipo == 'anual':
+        return {'hora': hora, 'repeticion': dia_aleatorio.strftime("%m-%d"), 'fecha': None}
+    return {'hora': hora, 'repeticion': None, 'fecha': dia_aleatorio.strftime("%Y-%m-%d")}
+
+def cargar_backend(ruta):
+    spec = importlib.util.spec_from_file_location("schedule_controller", ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+def simular(args):
+    rng = random.Random(args.semilla)
+    inicio = datetime.strptime(args.inicio, "%Y-%m-%d") + timedelta(seconds=30)
+    fin = inicio + timedelta(days=args.dias)
+    reloj = RelojSimulado(inicio)
+
+    modulo = cargar_backend(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedule-controller.py'))
+    modulo.hora_actual = reloj.ahora
+    modulo.scheduler = SchedulerSimulado(reloj)
+    modulo.shutil = types.SimpleNamespace(which=lambda nombre: f"/usr/bin/{nombre}")
+    gui = TkinterSimulado(reloj)
+    gui.instalar()
+    reproductor = ReproductorSimulado(modulo, reloj)
+    modulo._reproducir_con_proceso = reproductor
+    modulo.inicializar_db()
+    modulo.recargar_excepciones()
+    modulo.scheduler.start()
+    for i in range(4):
+        open(os.path.join(os.environ['ORANGECLOCK_AUDIOS'], f"tono{i}.mp3"), 'wb').close()
+    cliente = modulo.app.test_client()
+
+    activas = {}     # id -> (spec, desde)
+    historial = []   # (id, spec, desde, hasta)
+    excepciones = [] # (alarma_id o None, desde, hasta)
+    errores_api = []
+    proximas_erroneas = []
+    muestras = []
+
+    def payload(spec):
+        return dict(spec, audio=f"tono{rng.randrange(4)}.mp3")
+
+    def crear():
+        spec = generar_spec(rng, reloj.ahora(), fin)
+        r = cliente.post('/api/crear_alarma', json=payload(spec))
+        if r.status_code == 201:
+            activas[r.get_json()['id']] = (spec, reloj.ahora())
+        elif r.status_code != 400:
+            errores_api.append(('crear', r.status_code, r.get_data(as_text=True)[:200]))
+
+    def cerrar(alarma_id):
+        spec, desde = activas.pop(alarma_id)
+        historial.append((alarma_id, spec, desde, reloj.ahora()))
+
+    def mutar():
+        accion = rng.choice(['crear', 'editar', 'eliminar']) if activas else 'crear'
+        if accion == 'crear':
+            crear()
+            return
+        alarma_id = rng.choice(sorted(activas))
+        if accion == 'editar':
+            spec = generar_spec(rng, reloj.ahora(), fin)
+            r = cliente.put(f'/api/editar_alarma/{alarma_id}', json=payload(spec))
+            if r.status_code == 200:
+                cerrar(alarma_id)
+                activas[alarma_id] = (spec, reloj.ahora())
+            else:
+                errores_api.append(('editar', r.status_code, r.get_data(as_text=True)[:200]))
+        else:
+            r = cliente.delete(f'/api/eliminar_alarma/{alarma_id}')
+            if r.status_code == 200:
+                cerrar(alarma_id)
+            else:
+                errores_api.append(('eliminar', r.status_code, r.get_data(as_text=True)[:200]))
+
+    def comprobar_proximas():
+        ahora = reloj.ahora()
+        r = cliente.get('/api/alarmas_proximas')
+        if r.status_code != 200:
+            errores_api.append(('proximas', r.status_code, r.get_data(as_text=True)[:200]))
+            return
+        obtenidas = {a['id'] for a in r.get_json()['alarmas_proximas']}
+        esperadas = {i for i, (spec, _) in activas.items()
+                     if next(ocurrencias(spec, ahora - timedelta(microseconds=1), ahora + timedelta(hours=24),
+                                         excepciones, i), None)}
+        if obtenidas != esperadas:
+            proximas_erroneas.append((ahora, sorted(esperadas - obtenidas), sorted(obtenidas - esperadas)))
+
+        r = cliente.get('/api/ocurrencias?dias=1')
+        obtenidas = {(o['id'], o['fecha_hora']) for o in r.get_json()['ocurrencias']}
+        esperadas = {(i, m.strftime("%Y-%m-%d %H:%M")) for i, (spec, _) in activas.items()
+                     for m in ocurrencias(spec, ahora, ahora + timedelta(days=1), excepciones, i)}
+        if obtenidas != esperadas:
+            proximas_erroneas.append((ahora, sorted(esperadas - obtenidas)[:3], sorted(obtenidas - esperadas)[:3]))
+
+    def muestrear():
+        gui.recoger()
+        muestras.append((reloj.ahora(),) + recursos())
+
+    for _ in range(args.alarmas):
+        crear()
+    for _ in range(args.excepciones):
+        alarma_id = rng.choice(sorted(activas)) if rng.random() < 0.9 else None
+        desde = (inicio + timedelta(days=rng.randrange(args.dias))).date()
+        hasta = desde + timedelta(days=rng.randrange(4))
+        r = cliente.post('/api/excepciones', json={'alarma_id': alarma_id, 'desde': desde.isoformat(),
+                                                   'hasta': hasta.isoformat(), 'motivo': 'feriado'})
+        if r.status_code == 201:
+            excepciones.append((alarma_id, desde, hasta))
+        else:
+            errores_api.append(('excepcion', r.status_code, r.get_data(as_text=True)[:200]))
+
+    eventos = []
+    secuencia = 0
+    for dia in range(args.dias):
+        base = inicio + timedelta(days=dia)
+        programados = [(base, muestrear)]
+        programados += [(base + timedelta(minutes=rng.randrange(1440)), mutar) for _ in range(args.cambios_diarios)]
+        programados += [(base + timedelta(minutes=rng.randrange(1440)), comprobar_proximas) for _ in range(4)]
+        if args.reinicios_cada and dia and dia % args.reinicios_cada == 0:
+            programados.append((base + timedelta(minutes=rng.randrange(1440)), modulo.cargar_alarmas))
+        for momento, accion in programados:
+            secuencia += 1
+            heapq.heappush(eventos, (momento, secuencia, accion))
+
+    while eventos:
+        momento, _, accion = heapq.heappop(eventos)
+        modulo.scheduler.ejecutar_hasta(momento)
+        reloj.avanzar_hasta(momento)
+        accion()
+    modulo.scheduler.ejecutar_hasta(fin)
+    reloj.avanzar_hasta(fin)
+    muestrear()
+    for alarma_id in list(activas):
+        cerrar(alarma_id)
+
+    # Comparar disparos esperados y reales
+    esperados = {}
+    for alarma_id, spec, desde, hasta in historial:
+        for momento in ocurrencias(spec, desde, hasta, excepciones, alarma_id):
+            esperados[(alarma_id, momento)] = esperados.get((alarma_id, momento), 0) + 1
+    reales = {}
+    for clave in reproductor.disparos:
+        reales[clave] = reales.get(clave, 0) + 1
+    faltantes = sorted(k for k in esperados if k not in reales)
+    duplicados = sorted(k for k, n in reales.items() if n > esperados.get(k, 0) and k in esperados)
+    inesperados = sorted(k for k in reales if k not in esperados)
+
+    return {
+        'modulo': modulo,
+        'gui': gui,
+        'reproductor': reproductor,
+        'esperados': sum(esperados.values()),
+        'faltantes': faltantes,
+        'duplicados': duplicados,
+        'inesperados': inesperados,
+        'errores_api': errores_api,
+        'proximas_erroneas': proximas_erroneas,
+        'muestras': muestras,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación acelerada de semanas de alarmas")
+    parser.add_argument('--alarmas', type=int, default=400, help="alarmas sintéticas creadas al inicio")
+    parser.add_argument('--dias', type=int, default=28, help="días simulados")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--inicio', default="2026-01-05", help="fecha inicial simulada (YYYY-MM-DD)")
+    parser.add_argument('--excepciones', type=int, default=20, help="rangos de fechas exceptuadas")
+    parser.add_argument('--cambios-diarios', type=int, default=20, help="crear/editar/eliminar por día")
+    parser.add_argument('--reinicios-cada', type=int, default=7, help="días entre reinicios simulados (0 = ninguno)")
+    parser.add_argument('--max-hilos', type=int, default=2, help="crecimiento máximo de hilos tolerado")
+    parser.add_argument('--max-fds', type=int, default=4, help="crecimiento máximo de descriptores tolerado")
+    parser.add_argument('--max-rss-mb', type=int, default=32, help="crecimiento máximo de RSS tolerado (MB)")
+    args = parser.parse_args()
+
+    salida = sys.stdout
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directorio:
+        audios = os.path.join(directorio, 'audios')
+        os.makedirs(audios)
+        os.environ['ORANGECLOCK_AUDIOS'] = audios
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')  # pygame se inicializa al importar el backend
+        cwd = os.getcwd()
+        os.chdir(directorio)
+        try:
+            with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+                r = simular(args)
+        finally:
+            os.chdir(cwd)
+
+    fallos = []
+    if r['faltantes']:
+        fallos.append(f"{len(r['faltantes'])} ocurrencias no ejecutadas, p. ej. {r['faltantes'][:3]}")
+    if r['duplicados']:
+        fallos.append(f"{len(r['duplicados'])} ocurrencias ejecutadas más de una vez, p. ej. {r['duplicados'][:3]}")
+    if r['inesperados']:
+        fallos.append(f"{len(r['inesperados'])} disparos no esperados, p. ej. {r['inesperados'][:3]}")
+    if r['errores_api']:
+        fallos.append(f"{len(r['errores_api'])} errores de API, p. ej. {r['errores_api'][:2]}")
+    if r['proximas_erroneas']:
+        fallos.append(f"{len(r['proximas_erroneas'])} consultas de alarmas_proximas incorrectas, p. ej. {r['proximas_erroneas'][:2]}")
+    if r['reproductor'].sesiones_no_registradas:
+        fallos.append(f"{r['reproductor'].sesiones_no_registradas} reproducciones sin sesión registrada")
+    if r['modulo']._sesiones:
+        fallos.append(f"{len(r['modulo']._sesiones)} sesiones de reproducción sin liberar")
+
+    # Crecimiento de recursos desde el primer día completo (tras calentar imports y caches)
+    muestras = r['muestras']
+    base = muestras[1] if len(muestras) > 2 else muestras[0]
+    final = muestras[-1]
+    _, hilos0, fds0, rss0 = base
+    _, hilos1, fds1, rss1 = final
+    if hilos1 - hilos0 > args.max_hilos:
+        fallos.append(f"hilos: {hilos0} -> {hilos1}")
+    if fds0 is not None and fds1 - fds0 > args.max_fds:
+        fallos.append(f"descriptores abiertos: {fds0} -> {fds1}")
+    if rss0 is not None and (rss1 - rss0) / 1024 > args.max_rss_mb:
+        fallos.append(f"RSS: {rss0 // 1024} MB -> {rss1 // 1024} MB")
+
+    print(f"[SOAK] Días simulados: {args.dias}, disparos esperados: {r['esperados']}, "
+          f"ejecutados: {len(r['reproductor'].disparos)}, perdidos por misfire: {r['modulo'].scheduler.perdidos}", file=salida)
+    print(f"[SOAK] Mensajes GUI: {r['gui'].mensajes}", file=salida)
+    print(f"[SOAK] Recursos (hilos/fds/RSS kB): {base[1:]} -> {final[1:]}", file=salida)
+    for fallo in fallos:
+        print(f"[SOAK] ✗ {fallo}", file=salida)
+    if fallos:
+        sys.exit(1)
+    print("[SOAK] ✓ Simulación completada sin fallos", file=salida)
+
+if __name__ == '__main__':
+    main()
@@ -339,7 +339,8 @@ Description=Orange Clock Backend
 After=network.target
 
 [Service]
-Type=simple
+Type=notify
+NotifyAccess=main
 User=root
 WorkingDirectory=$BACKEND_DIR
 # Usar el intérprete del virtualenv para garantizar uso de Python3 y dependencias instaladas
@@ -348,6 +349,7 @@ Environment=PYTHONUNBUFFERED=1
 ExecStart=$BACKEND_DIR/venv/bin/python $BACKEND_DIR/schedule-controller.py
 Restart=always
 RestartSec=5
+WatchdogSec=20
 
 [Install]
 WantedBy=multi-user.target
@@ -500,6 +502,14 @@ else
     fi
 fi
 
+# Precomprimir el build (.gz y, si hay brotli, .br) para servirlo con ORANGECLOCK_FRONTEND
+if [ -f "$FRONT_DEST/index.html" ]; then
+    log "Precomprimiendo build del frontend en $FRONT_DEST"
+    sudo "$VENV_PIP" install brotli >>"$BACKEND_LOG" 2>&1 || log "brotli no disponible: solo se generará gzip"
+    sudo "$VENV_PY" "$BACKEND_DIR/precompress-build.py" "$FRONT_DEST" | tee -a "$BACKEND_LOG" || true
+    sudo chmod -R a+rX "$FRONT_DEST"
+fi
+
 # Eliminar cualquier servicio systemd del frontend (no lo recreamos ahora)
 if systemctl list-units --full -all | grep -q "clock_frontend.service"; then
     log "Se eliminará cualquier service clock_frontend.service existente (no se recreará)."
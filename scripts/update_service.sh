@@ -30,13 +30,15 @@ After=network.target sound.target
 Wants=network.target
 
 [Service]
-Type=simple
+Type=notify
+NotifyAccess=main
 User=orangepi
 Group=orangepi
 WorkingDirectory=/home/orangepi/clock_api
 ExecStart=/home/orangepi/clock_api_env/bin/python3 /home/orangepi/clock_api/schedule-controller.py
 Restart=always
 RestartSec=3s
+WatchdogSec=20
 Environment="PATH=/home/orangepi/clock_api_env/bin:/usr/bin"
 Environment=DISPLAY=:0
 Environment=XAUTHORITY=/home/orangepi/.Xauthority